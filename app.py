@@ -3,14 +3,29 @@ import pymysql
 import bcrypt
 import os
 from fpdf import FPDF, XPos, YPos
-import fitz  # PDF
 import pandas as pd
 import google.generativeai as genai
 from langdetect import detect
-import requests
-from bs4 import BeautifulSoup
 import time
-import docx  # --- NEW: Added import for processing .docx files ---
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from extractors import (
+    EXTRACTOR_VERSIONS, spooled_upload, load_csv_frame, profile_frame, FILTER_OPERATORS, filter_frame,
+    extract_pdf, extract_docx, extract_csv, extract_txt, ingest_files, read_question_list,
+)
+from cache import get_cache, cached_extractor, extraction_key, hash_upload, content_hash
+from web import fetch_all, http_stats
+from normalize import normalize_text
+from llm import (
+    FakeModel, FakeContextCaches, GeminiContextCaches, ModelContexts, CONTEXT_CACHE_MIN_TOKENS,
+    PROMPT_TOKEN_BUDGET, content_budget, sent_prompt_tokens, trim_to_tokens, usage_tokens, UsageTotals,
+    map_reduce_answer,
+    ResilientModel, FaultyModel, CircuitOpenError, get_provider_guard,
+    get_answer_cache, get_similar_cache, ConversationMemory, history_block, is_follow_up,
+    get_single_flight, single_flight_key, INTERACTIVE, BULK, get_model_router, parse_user_weights,
+)
+from retrieval import build_index, load_or_build_vectors, retrieve_context, approx_tokens, chunk_text
+from jobs import JobCancelled, get_job_executor
 
 
 def get_connection():
@@ -130,10 +145,37 @@ elif st.session_state.page == "signup":
 
 # ------------------ CONFIG ------------------
 # Make sure to set GEMINI_API_KEY in your Streamlit secrets
+# (or set EQUITYTOOL_FAKE_MODEL=1 to run against a local fake model)
 try:
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-    # Use the model you prefer
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    # MODEL_NAME is the fast default; questions that need it are routed to HEAVY_MODEL_NAME
+    if os.environ.get("EQUITYTOOL_FAKE_MODEL"):
+        MODEL_NAME = "fake-model"
+        HEAVY_MODEL_NAME = "fake-model-heavy"
+        model = FakeModel(MODEL_NAME)
+        heavy_model = FakeModel(HEAVY_MODEL_NAME, chunk_delay=0.15)
+        # e.g. EQUITYTOOL_FAKE_FAULT_RATE=0.3 to see retries and the circuit breaker at work
+        if os.environ.get("EQUITYTOOL_FAKE_FAULT_RATE"):
+            model = FaultyModel(model, failure_rate=float(os.environ["EQUITYTOOL_FAKE_FAULT_RATE"]))
+            heavy_model = FaultyModel(heavy_model, failure_rate=float(os.environ["EQUITYTOOL_FAKE_FAULT_RATE"]))
+        context_backends = {name: FakeContextCaches(name) for name in (MODEL_NAME, HEAVY_MODEL_NAME)}
+    else:
+        genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+        # Use the models you prefer
+        MODEL_NAME = os.environ.get("EQUITYTOOL_FAST_MODEL", "gemini-2.5-flash")
+        HEAVY_MODEL_NAME = os.environ.get("EQUITYTOOL_HEAVY_MODEL", "gemini-2.5-pro")
+        model = genai.GenerativeModel(MODEL_NAME)
+        heavy_model = genai.GenerativeModel(HEAVY_MODEL_NAME)
+        context_backends = {name: GeminiContextCaches(name) for name in (MODEL_NAME, HEAVY_MODEL_NAME)}
+    # Fair scheduling, retries, backoff, the shared rate limit and the circuit breaker
+    model = ResilientModel(model)
+    models = {MODEL_NAME: model, HEAVY_MODEL_NAME: ResilientModel(heavy_model)}
+    router = get_model_router(MODEL_NAME, HEAVY_MODEL_NAME)
+    # Fair-share weights for the scheduler, e.g. EQUITYTOOL_USER_WEIGHTS="alice=2,reports-bot=0.5"
+    user_weights, bad_weights = parse_user_weights(os.environ.get("EQUITYTOOL_USER_WEIGHTS", ""))
+    for weight_user, weight in user_weights.items():
+        model.guard.scheduler.set_weight(weight_user, weight)
+    if bad_weights:
+        st.warning(f"Ignoring EQUITYTOOL_USER_WEIGHTS entries (need user=positive number): {', '.join(bad_weights)}")
 except KeyError:
     st.error("GEMINI_API_KEY not found in Streamlit secrets. Please add it to run the app.")
     st.stop()
@@ -142,6 +184,11 @@ except Exception as e:
     st.stop()
 
 
+# Large documents are registered once with the provider as cached context
+# instead of being re-sent with every question
+USE_CONTEXT_CACHE = True
+
+
 # Initialize theme in session state
 if "theme" not in st.session_state:
     st.session_state.theme = "Dark"
@@ -401,39 +448,96 @@ st.markdown(get_custom_css(st.session_state.theme), unsafe_allow_html=True)
 
 # ------------------ TEXT EXTRACTORS ------------------
 
-def extract_text_from_pdf(uploaded_file):
-    text = ""
-    doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-    for page in doc:
-        text += page.get_text()
-    return text
+MAX_ARTICLE_URLS = 50
+
+# Extracted text is cached on disk by file hash, so the same 10-K is only parsed once
+EXTRACTION_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+extraction_cache = get_cache("extractions", max_bytes=EXTRACTION_CACHE_MAX_BYTES)
+
+@cached_extractor(extraction_cache, "pdf", version=EXTRACTOR_VERSIONS["pdf"])
+def extract_text_from_pdf(uploaded_file, on_page=None):
+    # Pages stream in order from the process pool; on_page(page_no, page_count)
+    # lets the UI show progress while the rest are still being extracted
+    with spooled_upload(uploaded_file, suffix=".pdf") as source:
+        return extract_pdf(source, on_page=on_page)
 
 # Function to extract text from .docx files
+# Streams paragraphs and table rows out of the .docx zip in document order
+@cached_extractor(extraction_cache, "docx", version=EXTRACTOR_VERSIONS["docx"])
 def extract_text_from_docx(uploaded_file):
-    doc = docx.Document(uploaded_file)
-    full_text = []
-    for para in doc.paragraphs:
-        full_text.append(para.text)
-    return '\n'.join(full_text)
+    with spooled_upload(uploaded_file, suffix=".docx") as source:
+        return extract_docx(source)
 # END FUNCTION
 
-def extract_text_from_csv(uploaded_file):
-    df = pd.read_csv(uploaded_file)
-    return df.to_string(index=False)
+# Only a compact profile goes into the prompt; the full table stays in
+# st.session_state.data_frame for querying
+@cached_extractor(extraction_cache, "csv", version=EXTRACTOR_VERSIONS["csv"])
+def extract_text_from_csv(uploaded_file, frame=None):
+    if frame is None:
+        with spooled_upload(uploaded_file, suffix=".csv") as source:
+            return extract_csv(source)
+    return profile_frame(frame)
 
+@cached_extractor(extraction_cache, "txt", version=EXTRACTOR_VERSIONS["txt"])
 def extract_text_from_txt(uploaded_file):
-    return uploaded_file.read().decode("utf-8")
-
-def extract_text_from_url(url):
-    try:
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Get visible text only
-        paragraphs = [p.get_text() for p in soup.find_all('p')]
-        return "\n".join(paragraphs[:50])  # Limit to 50 paragraphs
-    except Exception as e:
-        st.error(f"Error fetching {url}: {e}")
-        return f"Error fetching {url}: {e}"
+    with spooled_upload(uploaded_file, suffix=".txt") as source:
+        return extract_txt(source)
+
+# MIME type -> (extractor kind, label)
+UPLOAD_KINDS = {
+    "application/pdf": ("pdf", "📄 PDF"),
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ("docx", "📄 DOCX"),
+    "text/csv": ("csv", "📊 CSV"),
+    "text/plain": ("txt", "📝 TXT"),
+}
+
+def extract_text_from_uploads(uploaded_files, on_done=None):
+    """
+    Batch version of the extractors above for several files at once. Cached
+    files are answered straight away, the rest go to the process pool one
+    file per worker. Returns a list of dicts (name, kind, text, status,
+    seconds) in upload order; on_done(done_count, total) drives progress.
+    """
+    results = []
+    pending = []
+    for uploaded_file in uploaded_files:
+        kind = UPLOAD_KINDS.get(uploaded_file.type, (None, None))[0]
+        result = {"name": uploaded_file.name, "kind": kind, "text": "", "status": "", "seconds": 0.0}
+        results.append(result)
+        if kind is None:
+            result["status"] = "⚠️ Unsupported type"
+            continue
+        key = extraction_key(kind, EXTRACTOR_VERSIONS[kind], hash_upload(uploaded_file))
+        cached = extraction_cache.get(key)
+        if cached is not None:
+            result.update(text=cached, status="⚡ Cached")
+        else:
+            pending.append((result, key, uploaded_file))
+
+    done = len(results) - len(pending)
+    if on_done:
+        on_done(done, len(results))
+
+    # Workers open the files by path, so every pending upload is spooled to disk
+    with ExitStack() as stack:
+        items = [
+            (result["kind"], stack.enter_context(spooled_upload(uploaded_file, suffix=f".{result['kind']}", threshold=0)))
+            for result, key, uploaded_file in pending
+        ]
+
+        def file_done(i):
+            nonlocal done
+            done += 1
+            if on_done:
+                on_done(done, len(results))
+
+        for (result, key, uploaded_file), (text, seconds, error) in zip(pending, ingest_files(items, on_done=file_done)):
+            if error:
+                result.update(status=f"❌ {error}", seconds=seconds)
+            else:
+                extraction_cache.set(key, text)
+                result.update(text=text, status="✅ Extracted", seconds=seconds)
+    return results
 
 
 # ------------------ PDF GENERATION ------------------
@@ -539,12 +643,172 @@ def detect_language(text):
 
 
 
+def describe_model_error(error):
+    if isinstance(error, CircuitOpenError):
+        return str(error)
+    return f"The Gemini API failed after retries: {error}"
+
+
 # --- MODIFIED FUNCTION ---
-def ask_question_with_gemini(content_text, question, target_language="English"):
+def ask_question_with_gemini(content_text, question, target_language="English", index=None, vectors=None,
+                             content_hash=None, meta=None, on_chunk=None, context=None,
+                             map_reduce=False, on_progress=None, history="", user=None, priority=INTERACTIVE,
+                             deep=False, check_cancelled=None):
     """
-    Asks a question to the Gemini model with content and a target language.
+    Answers a question about the content in `target_language`: from the
+    answer caches, by sharing an identical call already in flight, or by
+    calling the routed model (see answer_uncached for how the prompt is
+    built). `history` is only used for follow-ups. With on_chunk the answer
+    is streamed; `meta` is filled in with how it was produced. Returns None
+    if the model couldn't be reached; meta["error"] says why.
     """
-    prompt = f"""
+    meta = meta if meta is not None else {}
+    meta["follow_up"] = bool(history) and is_follow_up(question)
+    if not meta["follow_up"]:
+        history = ""
+    meta["history_tokens"] = approx_tokens(history)
+    # Routed first: answers are cached per model
+    prompt_tokens = sent_prompt_tokens(approx_tokens(content_text), question, history, map_reduce)
+    model_name, meta["route_reason"] = router.route(question, prompt_tokens, deep=deep)
+    meta["model"] = model_name
+    answer_cache = get_answer_cache()
+    if content_hash and not history:
+        cached = answer_cache.get(content_hash, question, target_language, model_name)
+        if cached is not None:
+            meta["cached"] = "exact"
+            return cached
+        similar = get_similar_cache().get(content_hash, question, target_language, model_name)
+        if similar is not None:
+            answer, meta["similar_to"], meta["similarity"] = similar
+            meta["cached"] = "similar"
+            return answer
+
+    request = dict(
+        index=index, vectors=vectors, content_hash=content_hash, meta=meta, context=context,
+        map_reduce=map_reduce, on_progress=on_progress, history=history, user=user, priority=priority,
+        model_name=model_name, check_cancelled=check_cancelled,
+    )
+    if not content_hash:
+        return answer_uncached(content_text, question, target_language, on_chunk=on_chunk, **request)
+
+    # The same question already being answered for someone else is waited on, not asked again
+    def lead(flight):
+        def publish(text):
+            flight.partial = text
+            on_chunk(text)
+        flight.meta = meta
+        return answer_uncached(content_text, question, target_language,
+                               on_chunk=publish if on_chunk else None, **request)
+
+    start = time.perf_counter()
+    answer, flight, shared = get_single_flight().do(
+        single_flight_key(content_hash, question, target_language, model_name, history), lead, on_update=on_chunk,
+        check_cancelled=check_cancelled
+    )
+    if shared:
+        # The tokens were spent, and logged, by the request that made the call
+        meta.update({key: value for key, value in flight.meta.items()
+                     if key not in ("input_tokens", "output_tokens", "tokens_estimated", "ttft")})
+        meta["coalesced"] = True
+        meta["latency"] = time.perf_counter() - start
+    return answer
+
+
+def answer_uncached(content_text, question, target_language, *, index, vectors, content_hash,
+                    meta, on_chunk, context, map_reduce, on_progress, history, user, priority, model_name,
+                    check_cancelled):
+    # Everything ask_question_with_gemini does once the caches have missed
+    user_model = models[model_name].for_user(user, priority, check_cancelled)
+
+    def generate(call_model, prompt):
+        start = time.perf_counter()
+        if on_chunk is None:
+            response = call_model.generate_content(prompt)
+            answer = response.text
+            usage = getattr(response, "usage_metadata", None)
+        else:
+            parts = []
+            usage = None
+            for chunk in call_model.generate_content(prompt, stream=True):
+                if not parts:
+                    meta["ttft"] = time.perf_counter() - start
+                parts.append(chunk.text)
+                # The last chunk carries the totals for the whole stream
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                on_chunk("".join(parts))
+            answer = "".join(parts)
+        meta["latency"] = time.perf_counter() - start
+        meta["input_tokens"], meta["output_tokens"], meta["tokens_estimated"] = usage_tokens(usage, prompt, answer)
+        return answer
+
+    # The prompt is sized first, and the budget holds on every path:
+    #   1. over budget with "Read the whole document" on: map-reduce
+    #   2. within budget and cached with the provider: the cached context
+    #   3. otherwise inline, narrowed to the best chunks or trimmed to fit
+    answer = None
+    budget = content_budget(question, history)
+    meta["content_tokens"] = approx_tokens(content_text)
+    fits = meta["content_tokens"] <= budget
+    use_map_reduce = map_reduce and not fits
+
+    if use_map_reduce:
+        chunks = index.chunks if index is not None else chunk_text(content_text)
+        usage = UsageTotals()
+
+        def generate_part(part_prompt):
+            response = user_model.generate_content(part_prompt)
+            usage.add(response, part_prompt)
+            return response.text
+
+        try:
+            start = time.perf_counter()
+            answer = map_reduce_answer(
+                generate_part, chunks, question, target_language, on_progress=on_progress, stats=meta,
+                history=history
+            )
+            meta["latency"] = time.perf_counter() - start
+            meta["budget_action"] = "map_reduce"
+            # Every map and reduce call, so the log shows what the answer really cost
+            meta["input_tokens"], meta["output_tokens"], meta["tokens_estimated"] = usage.totals()
+        except JobCancelled:
+            raise
+        except Exception as e:
+            meta["error"] = describe_model_error(e)
+            return None
+
+    # A provider cache belongs to one model; this looks up (or creates) the routed model's
+    document = context.get(model_name) if context is not None and fits else None
+    cached_model = document.model() if document is not None else None
+    if cached_model is not None:
+        cached_model = ResilientModel(cached_model, user=user, priority=priority, check_cancelled=check_cancelled)
+    if cached_model is not None:
+        prompt = f"""
+Use the document in the cached context to answer the question clearly and concisely in {target_language}.
+
+{history_block(history)}Question: {question}
+Answer in {target_language}:
+"""
+        try:
+            answer = generate(cached_model, prompt)
+            meta["context_cache"] = True
+        except JobCancelled:
+            raise
+        except Exception as e:
+            # Fall through to the inline prompt below, and stay inline for later questions
+            print(f"Context cache call failed, sending the content inline: {e}")
+            document.discard(e)
+
+    if answer is None:
+        # Keep the whole prompt inside the per-call budget: best chunks first,
+        # hard trim if even that doesn't fit
+        if meta["content_tokens"] > budget and index is not None:
+            content_text = retrieve_context(index, question, vectors=vectors, token_budget=budget)
+            meta["budget_action"] = "retrieved"
+        if approx_tokens(content_text) > budget:
+            content_text = trim_to_tokens(content_text, budget)
+            meta["budget_action"] = "trimmed"
+
+        prompt = f"""
 You are a helpful research assistant called EquityTool.
 Use the following content to answer the question clearly and concisely in {target_language}.
 
@@ -553,15 +817,24 @@ Content:
 {content_text}
 \"\"\"
 
-Question: {question}
+{history_block(history)}Question: {question}
 Answer in {target_language}:
 """
-    try:
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        st.error(f"An error occurred with the Gemini API: {e}")
-        return f"Error: {e}"
+        try:
+            answer = generate(user_model, prompt)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            meta["error"] = describe_model_error(e)
+            return None
+
+    if meta.get("budget_action") != "map_reduce":
+        # Map-reduce fans out into many calls, its wall time says nothing about one call
+        router.record(model_name, meta["latency"])
+    if content_hash and not history:
+        get_answer_cache().put(content_hash, question, target_language, model_name, answer, meta["latency"])
+        get_similar_cache().put(content_hash, question, target_language, model_name, answer, meta["latency"])
+    return answer
 
 
 # ------------------ STREAMLIT UI ------------------
@@ -575,6 +848,24 @@ if "total_content" not in st.session_state:
     st.session_state.total_content = ""
 if "question" not in st.session_state:
     st.session_state.question = ""
+if "data_frame" not in st.session_state:
+    st.session_state.data_frame = None
+if "content_index" not in st.session_state:
+    st.session_state.content_index = None
+if "content_vectors" not in st.session_state:
+    st.session_state.content_vectors = None
+if "content_hash" not in st.session_state:
+    st.session_state.content_hash = None
+if "document_context" not in st.session_state:
+    st.session_state.document_context = None
+if "call_log" not in st.session_state:
+    st.session_state.call_log = []
+if "batch_results" not in st.session_state:
+    st.session_state.batch_results = []
+if "active_jobs" not in st.session_state:
+    st.session_state.active_jobs = []
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory()
 
 # Add initial welcome message if the chat is empty
 # if not st.session_state.messages:
@@ -599,9 +890,22 @@ with st.sidebar:
         st.session_state.page = "login"
         st.session_state.username = ""
         # Clear chat and content on logout
+        for active in st.session_state.active_jobs:
+            get_job_executor().cancel(active["id"])
+        st.session_state.active_jobs = []
         st.session_state.messages = []
+        st.session_state.memory.clear()
+        st.session_state.call_log = []
+        st.session_state.batch_results = []
         st.session_state.content_loaded = False
         st.session_state.total_content = ""
+        st.session_state.data_frame = None
+        st.session_state.content_index = None
+        st.session_state.content_vectors = None
+        if st.session_state.document_context:
+            st.session_state.document_context.close()
+        st.session_state.document_context = None
+        st.session_state.content_hash = None
         if hasattr(st.session_state, 'content_source'):
             delattr(st.session_state, 'content_source')
         st.rerun()
@@ -641,19 +945,28 @@ with st.sidebar:
     
     if resource_type == "📄 Upload Document":
         st.markdown("#### Upload Documents")
-        uploaded_file = st.file_uploader(
-            "Choose a file",
+        uploaded_files = st.file_uploader(
+            "Choose files",
             # --- MODIFIED: Added "docx" to type list ---
             type=["pdf", "csv", "txt", "docx"],
             # --- MODIFIED: Updated help text ---
-            help="Supported formats: PDF, DOCX, CSV, TXT",
+            help="Supported formats: PDF, DOCX, CSV, TXT. Drop in several files to load them together.",
+            accept_multiple_files=True,
             label_visibility="collapsed"
         )
         
-        if uploaded_file and st.button("📊 Process Document", type="primary", use_container_width=True):
+        if len(uploaded_files) == 1 and st.button("📊 Process Document", type="primary", use_container_width=True):
+            uploaded_file = uploaded_files[0]
             with st.spinner("Processing document..."):
+                st.session_state.data_frame = None
+                st.session_state.ingest_report = []
                 if uploaded_file.type == "application/pdf":
-                    content_text = extract_text_from_pdf(uploaded_file)
+                    page_progress = st.progress(0, text="Extracting pages...")
+                    content_text = extract_text_from_pdf(
+                        uploaded_file,
+                        on_page=lambda n, total: page_progress.progress(n / total, text=f"Extracted page {n} of {total}...")
+                    )
+                    page_progress.empty()
                     st.session_state.content_source = f"📄 PDF: {uploaded_file.name}"
                 # --- NEW: Added logic for .docx files ---
                 elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
@@ -661,34 +974,95 @@ with st.sidebar:
                     st.session_state.content_source = f"📄 DOCX: {uploaded_file.name}"
                 # --- END NEW LOGIC ---
                 elif uploaded_file.type == "text/csv":
-                    content_text = extract_text_from_csv(uploaded_file)
+                    with spooled_upload(uploaded_file, suffix=".csv") as source:
+                        frame = load_csv_frame(source)
+                    st.session_state.data_frame = frame
+                    content_text = extract_text_from_csv(uploaded_file, frame=frame)
                     st.session_state.content_source = f"📊 CSV: {uploaded_file.name}"
                 elif uploaded_file.type == "text/plain":
                     content_text = extract_text_from_txt(uploaded_file)
                     st.session_state.content_source = f"📝 TXT: {uploaded_file.name}"
+        
+        elif len(uploaded_files) > 1 and st.button(f"📊 Process {len(uploaded_files)} Documents", type="primary", use_container_width=True):
+            st.session_state.data_frame = None
+            batch_progress = st.progress(0, text="Processing documents...")
+            batch_start = time.perf_counter()
+            results = extract_text_from_uploads(
+                uploaded_files,
+                on_done=lambda done, total: batch_progress.progress(done / total, text=f"Processed {done} of {total} documents...")
+            )
+            batch_progress.empty()
+            
+            # One corpus, with a boundary line in front of every document
+            documents = []
+            for i, result in enumerate(results):
+                if result["text"]:
+                    documents.append(f"\n\n--- Document {i+1}: {result['name']} ---\n\n" + result["text"])
+            content_text = "".join(documents)
+            
+            st.session_state.ingest_report = [
+                {"File": r["name"], "Status": r["status"], "Seconds": round(r["seconds"], 2)} for r in results
+            ]
+            loaded = sum(1 for r in results if r["text"])
+            st.session_state.content_source = (
+                f"📚 {loaded} documents loaded in {time.perf_counter() - batch_start:.1f}s"
+            )
+        
+        # Per-file status of the last batch
+        if st.session_state.get("ingest_report"):
+            st.dataframe(st.session_state.ingest_report, hide_index=True, use_container_width=True)
+
+        cache_stats = extraction_cache.stats()
+        st.caption(
+            f"⚡ Extraction cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['entries']} files, {cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+        )
     
     elif resource_type == "🌐 Add Web Article":
-        st.markdown("#### Add Web Articles (up to 3)")
-        urls = []
+        st.markdown(f"#### Add Web Articles (up to {MAX_ARTICLE_URLS})")
+        url_list = st.text_area(
+            "URLs (one per line):",
+            height=150,
+            placeholder="https://example1.com/article\nhttps://example2.com/article",
+            key="url_list"
+        )
+        urls = [url.strip() for url in url_list.splitlines() if url.strip()]
+        if len(urls) > MAX_ARTICLE_URLS:
+            st.warning(f"Only the first {MAX_ARTICLE_URLS} URLs will be fetched.")
+            urls = urls[:MAX_ARTICLE_URLS]
         
-        # Three URL inputs
-        for i in range(1, 4):
-            url = st.text_input(f"URL {i}:", placeholder=f"https://example{i}.com/article", key=f"url_{i}")
-            if url.strip():
-                urls.append(url.strip())
+        offline_mode = st.checkbox(
+            "Offline mode (use cached pages only)",
+            key="offline_mode",
+            help="Serve previously fetched pages from the cache without contacting the sites"
+        )
         
         if urls and st.button("🌐 Fetch All Articles", type="primary", use_container_width=True):
-            content_text = ""
             progress_bar = st.progress(0, text="Fetching articles...")
             
-            for i, url in enumerate(urls):
-                with st.spinner(f"Fetching article {i+1} of {len(urls)}..."):
-                    article_content = extract_text_from_url(url)
-                    content_text += f"\n\n--- Article {i+1} from {url} ---\n\n" + article_content
-                    progress_bar.progress((i + 1) / len(urls), text=f"Fetched article {i+1}...")
+            # Fetched concurrently; the bar moves as each one finishes
+            results = fetch_all(
+                urls,
+                offline=offline_mode,
+                on_done=lambda done, total, url: progress_bar.progress(done / total, text=f"Fetched {done} of {total} articles...")
+            )
+            
+            # Keep the articles in the order they were entered
+            articles = []
+            for i, (url, article_content, error) in enumerate(results):
+                if error:
+                    st.error(f"Error fetching {url}: {error}")
+                    article_content = f"Error fetching {url}: {error}"
+                articles.append(f"\n\n--- Article {i+1} from {url} ---\n\n" + article_content)
+            content_text = "".join(articles)
             
             progress_bar.empty()
             st.session_state.content_source = f"🌐 Web Articles: {len(urls)} articles loaded"
+        
+        st.caption(
+            f"⚡ Page cache: {http_stats['fresh']} fresh / {http_stats['revalidated']} revalidated (304) / "
+            f"{http_stats['fetched']} downloaded / {http_stats['stale']} stale"
+        )
     
     elif resource_type == "📝 Enter Text Directly":
         st.markdown("#### Direct Text Input")
@@ -705,8 +1079,29 @@ with st.sidebar:
     
     # Process the content if any
     if content_text.strip():
+        # Headers/footers, hyphenation, whitespace and repeated lines are
+        # stripped once here instead of being paid for in every prompt
+        content_text, st.session_state.normalization_report = normalize_text(content_text)
         st.session_state.total_content = content_text
+        # Chunked and indexed once, each question then only sends the top chunks
+        st.session_state.content_index = build_index(content_text)
+        st.session_state.content_hash = content_hash(content_text)
+        st.session_state.content_vectors = load_or_build_vectors(
+            st.session_state.content_hash, st.session_state.content_index.chunks
+        )
+        # Register the document with the provider once per model; questions reference it.
+        # Only documents that fit the per-call budget, bigger ones are never sent whole
+        if st.session_state.get("document_context"):
+            st.session_state.document_context.close()
+        st.session_state.document_context = None
+        if USE_CONTEXT_CACHE and CONTEXT_CACHE_MIN_TOKENS <= approx_tokens(content_text) <= content_budget(""):
+            st.session_state.document_context = ModelContexts(context_backends, content_text)
+            # The fast model answers most questions, so its cache is made up front
+            st.session_state.document_context.get(MODEL_NAME)
         st.session_state.content_loaded = True
+        # Earlier turns and batch answers were about the previous content
+        st.session_state.memory.clear()
+        st.session_state.batch_results = []
         st.success(f"Content loaded successfully!")
         
         # Add system message to chat
@@ -721,10 +1116,21 @@ with st.sidebar:
     if st.session_state.content_loaded and hasattr(st.session_state, 'content_source'):
         st.markdown("### 📌 Current Source")
         st.info(st.session_state.content_source)
+        if st.session_state.document_context and st.session_state.document_context.active:
+            st.caption("🗄️ Document is cached with the model provider; questions don't re-send it")
         
         if st.button("🗑️ Clear Content", use_container_width=True):
             st.session_state.content_loaded = False
             st.session_state.total_content = ""
+            st.session_state.data_frame = None
+            st.session_state.content_index = None
+            st.session_state.content_vectors = None
+            if st.session_state.document_context:
+                st.session_state.document_context.close()
+            st.session_state.document_context = None
+            st.session_state.content_hash = None
+            st.session_state.memory.clear()
+            st.session_state.batch_results = []
             if hasattr(st.session_state, 'content_source'):
                 delattr(st.session_state, 'content_source')
             st.session_state.messages.append({
@@ -733,6 +1139,22 @@ with st.sidebar:
             })
             st.rerun()
     
+    # Query the loaded CSV locally instead of asking the model to read the rows
+    if st.session_state.content_loaded and st.session_state.data_frame is not None:
+        with st.expander("🔎 Query Table"):
+            frame = st.session_state.data_frame
+            st.caption(f"{len(frame):,} rows • {frame.memory_usage(deep=True).sum() / 1024 / 1024:.1f} MB in memory")
+            col_column, col_operator, col_value = st.columns([2, 1, 2])
+            filter_column = col_column.selectbox("Column", list(frame.columns), key="frame_filter_column")
+            filter_operator = col_operator.selectbox("Operator", list(FILTER_OPERATORS), key="frame_filter_operator")
+            filter_value = col_value.text_input("Value", key="frame_filter_value")
+            try:
+                filtered = filter_frame(frame, filter_column, filter_operator, filter_value) if filter_value.strip() else frame
+                st.caption(f"{len(filtered):,} matching rows (first 100 shown)")
+                st.dataframe(filtered.head(100), use_container_width=True)
+            except ValueError as e:
+                st.error(f"Invalid filter: {e}")
+    
     # --- NEW: Language selection ---
     st.markdown("### 🌐 Output Language")
     languages = [
@@ -749,13 +1171,52 @@ with st.sidebar:
         label_visibility="collapsed"
     )
 
+    st.checkbox(
+        "🧩 Read the whole document (map-reduce)",
+        key="map_reduce_mode",
+        help="For documents too big for one prompt: every part is read in parallel and the answers are combined. Slower and uses more calls than the default retrieval."
+    )
+    st.checkbox(
+        "🔬 Deep analysis",
+        key="deep_analysis",
+        help=f"Always answer with {HEAVY_MODEL_NAME}. Without it, only analysis questions and big prompts go there; lookups use {MODEL_NAME}."
+    )
+
+    # --- Batch questions: run a whole checklist against the loaded content ---
+    if st.session_state.content_loaded:
+        with st.expander("📋 Batch Questions"):
+            batch_text = st.text_area(
+                "One question per line:",
+                height=150,
+                placeholder="What was FY24 revenue?\nWhat are the main risk factors?",
+                key="batch_text"
+            )
+            batch_file = st.file_uploader("...or upload a list (TXT/CSV, first column)", type=["txt", "csv"], key="batch_file")
+            batch_questions = [q.strip() for q in batch_text.splitlines() if q.strip()]
+            if batch_file is not None:
+                batch_questions += read_question_list(batch_file, csv=batch_file.type == "text/csv")
+            
+            if batch_questions and st.button(f"▶️ Run {len(batch_questions)} Questions", use_container_width=True):
+                st.session_state.pending_batch = batch_questions
+            
+            if st.session_state.batch_results:
+                st.download_button(
+                    label="📥 Download Q&A (CSV)",
+                    data=pd.DataFrame(st.session_state.batch_results).to_csv(index=False).encode("utf-8"),
+                    file_name="equitytool_batch.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+
     # Content stats
     if st.session_state.content_loaded:
         st.markdown("### 📊 Content Statistics")
         content_length = len(st.session_state.total_content)
         word_count = len(st.session_state.total_content.split())
         
-        col1, col2 = st.columns(2)        
+        token_count = approx_tokens(st.session_state.total_content)
+        
+        col1, col2, col3 = st.columns(3)        
         with col1:
             st.markdown(f"""
             <div class="stats-card">
@@ -771,7 +1232,98 @@ with st.sidebar:
                 <p>Words</p>
             </div>
             """, unsafe_allow_html=True)
+        
+        with col3:
+            st.markdown(f"""
+            <div class="stats-card">
+                <h3>{token_count:,}</h3>
+                <p>Tokens (est.)</p>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Prompt size and latency of the model calls made in this session
+        if st.session_state.call_log:
+            last = st.session_state.call_log[-1]
+            total_in = sum(call["input_tokens"] for call in st.session_state.call_log)
+            total_out = sum(call["output_tokens"] for call in st.session_state.call_log)
+            st.caption(
+                f"🧮 Last call: {last['input_tokens']:,} in / {last['output_tokens']:,} out tokens, "
+                f"{last['latency']:.1f}s, {last.get('history_tokens', 0):,} of them history • "
+                f"Session: {len(st.session_state.call_log)} calls, "
+                f"{total_in:,} in / {total_out:,} out (budget {PROMPT_TOKEN_BUDGET:,} per call)"
+            )
 
+        memory = st.session_state.memory
+        if memory.turns:
+            st.caption(
+                f"🧠 Memory: last {len(memory.turns)} turns verbatim, {memory.folded_turns} summarized • "
+                f"~{approx_tokens(memory.render()):,} tokens sent with the next follow-up"
+            )
+
+        answer_stats = get_answer_cache().stats()
+        similar_cache = get_similar_cache()
+        st.caption(
+            f"⚡ Answer cache: {answer_stats['hit_rate']:.0%} hit rate "
+            f"({answer_stats['hits']} hits / {answer_stats['misses']} misses), "
+            f"{similar_cache.hits} similar-question hits, "
+            f"{answer_stats['seconds_saved'] + similar_cache.seconds_saved:.1f}s of model time saved"
+        )
+
+        guard = get_provider_guard()
+        client_stats = guard.metrics.stats()
+        st.caption(
+            f"🛡️ Model calls: {client_stats['attempts']} attempts, {client_stats['retries']} retries, "
+            f"{client_stats['errors']} errors, {client_stats['rejected']} failed fast • "
+            f"p50 {client_stats['p50']:.1f}s / p95 {client_stats['p95']:.1f}s • breaker {guard.breaker.state}"
+        )
+
+        flight_stats = get_single_flight().stats()
+        if flight_stats["coalesced"]:
+            st.caption(
+                f"🔗 Identical in-flight questions: {flight_stats['coalesced']} shared a call "
+                f"({flight_stats['coalesced_rate']:.0%} of {flight_stats['calls'] + flight_stats['coalesced']} requests), "
+                f"~{flight_stats['seconds_saved']:.0f}s of model time saved"
+            )
+
+        scheduler_stats = guard.scheduler.stats()
+        mine = scheduler_stats.get(st.session_state.username)
+        if mine:
+            st.caption(
+                f"🚦 Your model calls: {mine['running']} running, {mine['queued']} queued • queue wait "
+                f"p95 {mine['interactive_wait_p95']:.1f}s interactive / {mine['bulk_wait_p95']:.1f}s bulk"
+            )
+        if len(scheduler_stats) > 1:
+            with st.expander(f"🚦 Scheduler: {len(scheduler_stats)} users"):
+                st.dataframe(
+                    pd.DataFrame.from_dict(scheduler_stats, orient="index").round(2),
+                    use_container_width=True
+                )
+
+        route_stats = router.stats()
+        st.caption("🔀 Routing: " + " • ".join(
+            f"{name} {row['routed']} routed, p50 {row['p50']:.1f}s / p95 {row['p95']:.1f}s"
+            for name, row in route_stats.items()
+        ))
+        if router.decisions:
+            with st.expander("🔀 Recent routing decisions"):
+                st.dataframe(
+                    pd.DataFrame(list(router.decisions)[::-1], columns=["time", "model", "reason", "question_type", "prompt_tokens", "question"]),
+                    use_container_width=True
+                )
+
+        job_stats = get_job_executor().stats()
+        st.caption(
+            f"🧵 Answer jobs: {job_stats['running']} running, {job_stats['queued']} queued • "
+            f"wait avg {job_stats['wait_avg']:.1f}s / p95 {job_stats['wait_p95']:.1f}s"
+        )
+
+        # What the normalization pipeline saved on this content
+        report = st.session_state.get("normalization_report")
+        if report:
+            removed = sum(chars for _, chars in report)
+            with st.expander(f"🧹 Cleanup removed {removed:,} chars (~{removed // 4:,} tokens)"):
+                for stage, chars in report:
+                    st.caption(f"{stage.replace('_', ' ')}: {chars:,} chars (~{chars // 4:,} tokens)")
         
         st.markdown("---")
         st.markdown("### 📥 Export Chat")
@@ -794,6 +1346,33 @@ with st.sidebar:
 # Main chat container
 # st.markdown('<div class="chat-container">', unsafe_allow_html=True)
 
+# Answers are streamed into the chat piece by piece as the model produces them
+STREAM_ANSWERS = True
+
+def assistant_message_html(content, meta, streaming=False):
+    cached_marker = {
+        "exact": " <em>⚡ cached</em>",
+        "similar": " <em>⚡ cached (similar question)</em>",
+    }.get(meta.get("cached"), "")
+    if meta.get("coalesced"):
+        cached_marker = " <em>🔗 shared with an identical request</em>"
+    cursor = " ▌" if streaming else ""
+    timing = ""
+    if "latency" in meta:
+        first_token = f"first token {meta['ttft']:.1f}s • " if "ttft" in meta else ""
+        map_phase = ""
+        if "map_calls" in meta:
+            map_phase = (f" • {meta['map_calls']} parts read in {meta['map_seconds']:.1f}s "
+                         f"({meta['map_sequential_seconds']:.1f}s one by one)")
+        model_used = f" • {meta['model']}" if "model" in meta else ""
+        timing = f"<small>⏱ {first_token}total {meta['latency']:.1f}s{map_phase}{model_used}</small>"
+    return f"""
+        <div class="chat-message assistant-message">
+            <strong>EquityTool:</strong>{cached_marker} {content}{cursor}
+            {timing}
+        </div>
+        """
+
 # Display chat messages
 for message in st.session_state.messages:
     if message["role"] == "user":
@@ -803,11 +1382,7 @@ for message in st.session_state.messages:
         </div>
         """, unsafe_allow_html=True)
     elif message["role"] == "assistant":
-        st.markdown(f"""
-        <div class="chat-message assistant-message">
-            <strong>EquityTool:</strong> {message['content']}
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(assistant_message_html(message['content'], message.get("meta", {})), unsafe_allow_html=True)
     elif message["role"] == "system":
         st.markdown(f"""
         <div class="chat-message system-message">
@@ -838,26 +1413,251 @@ def handle_submit():
             "content": question
         })
         
-        # --- MODIFIED SECTION ---
-        # Generate response
-        with st.spinner("EquityTool is thinking..."):
-            # Get the target language from session state
-            target_language = st.session_state.get("output_language", "English")
-            answer = ask_question_with_gemini(
-                st.session_state.total_content, 
-                question, 
-                target_language
-            )
-        # --- END MODIFIED SECTION ---
+        # The answer is generated by a background job so this callback (and
+        # the session) is free again at once. The job only gets plain values:
+        # worker threads must not touch st.session_state.
+        job_id = get_job_executor().submit(
+            answer_job,
+            st.session_state.total_content,
+            question,
+            st.session_state.get("output_language", "English"),
+            index=st.session_state.content_index,
+            vectors=st.session_state.content_vectors,
+            content_hash=st.session_state.content_hash,
+            context=st.session_state.document_context,
+            map_reduce=st.session_state.get("map_reduce_mode", False),
+            history=st.session_state.memory.render(),
+            user=st.session_state.username,
+            deep=st.session_state.get("deep_analysis", False),
+        )
+        st.session_state.active_jobs.append({"id": job_id, "question": question})
+
+
+def answer_job(job, content_text, question, target_language, user=None, **kwargs):
+    # Runs on a job worker; streamed text and map progress are left on the job for the UI to poll
+    meta = {}
+    answer = ask_question_with_gemini(
+        content_text,
+        question,
+        target_language,
+        meta=meta,
+        on_chunk=job.set_partial if STREAM_ANSWERS else None,
+        on_progress=job.set_progress,
+        check_cancelled=job.check_cancelled,
+        user=user,
+        **kwargs
+    )
+    job.check_cancelled()
+    return answer, meta
+
+
+def fold_memory_job(job, memory, user):
+    # Summarizing turns out of the verbatim window is a model call; it runs on its own job
+    memory.fold(summarize=lambda prompt: model.for_user(user).generate_content(prompt).text)
 
-        # Add assistant response to chat
+
+def finish_job(active, job):
+    # Moves a finished job's answer (or failure) into the chat history
+    if active.get("batch"):
+        finish_batch(active, job)
+        return
+    question = active["question"]
+    if job.status == "cancelled":
+        st.session_state.messages.append({
+            "role": "system",
+            "content": f"⏹️ Cancelled: {question}"
+        })
+        return
+    if job.status == "failed":
+        answer, meta = None, {"error": describe_model_error(job.error)}
+    else:
+        answer, meta = job.result
+    if answer is None:
+        # A failed call is reported, not stored as if it were an answer
+        st.session_state.messages.append({
+            "role": "system",
+            "content": f"⚠️ Couldn't get an answer: {meta['error']}"
+        })
+    else:
         st.session_state.messages.append({
             "role": "assistant",
-            "content": answer
+            "content": answer,
+            "meta": meta
         })
-        
-        # --- FIX: Removed st.rerun() here ---
-        # The script will rerun automatically after this callback finishes.
+        memory = st.session_state.memory
+        memory.add_turn(question, answer)
+        if memory.needs_fold:
+            get_job_executor().submit(fold_memory_job, memory, st.session_state.username)
+    log_call(question, meta)
+
+
+def log_call(question, meta):
+    # Cached and coalesced answers made no call of their own and carry no token counts
+    if "input_tokens" not in meta:
+        return
+    st.session_state.call_log.append({
+        "question": question,
+        "input_tokens": meta["input_tokens"],
+        "output_tokens": meta["output_tokens"],
+        "latency": meta["latency"],
+        "history_tokens": meta["history_tokens"],
+    })
+    print(
+        f"LLM call: {meta['input_tokens']} in / {meta['output_tokens']} out tokens "
+        f"({meta['history_tokens']} of history), "
+        f"{meta['latency']:.2f}s{' (estimated)' if meta['tokens_estimated'] else ''}"
+    )
+
+
+JOB_POLL_SECONDS = 0.5
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_active_jobs():
+    # Only this fragment re-runs while jobs are in flight, not the whole page
+    executor = get_job_executor()
+    finished = False
+    for active in list(st.session_state.active_jobs):
+        job = executor.get(active["id"])
+        if job is None or job.finished:
+            if job is not None:
+                finish_job(active, job)
+                executor.forget(job.id)
+            st.session_state.active_jobs.remove(active)
+            finished = True
+            continue
+        if job.status == "queued":
+            status = f"⏳ Queued (position {executor.queue_position(job.id)}): {active['question']}"
+        elif active.get("batch"):
+            done = job.progress[0] if job.progress else 0
+            status = f"📋 Answered {done} of {active['batch']} checklist questions ({active['workers']} at a time)"
+        elif job.progress:
+            done, total = job.progress
+            status = f"📖 Reading part {done} of {total}: {active['question']}"
+        else:
+            status = f"💭 EquityTool is thinking: {active['question']}"
+        col_status, col_cancel = st.columns([5, 1])
+        col_status.caption(status)
+        col_cancel.button("Cancel", key=f"cancel_{job.id}", on_click=executor.cancel, args=(job.id,))
+        if job.partial:
+            st.markdown(assistant_message_html(job.partial, {}, streaming=True), unsafe_allow_html=True)
+    if finished:
+        st.rerun()
+
+
+if st.session_state.active_jobs:
+    render_active_jobs()
+
+# Checklist runs: the batch is one background job, so the session stays
+# usable while it runs. Questions go out as bulk work, as many at a time as
+# the scheduler lets one user run, and one failing question doesn't lose the
+# others' answers.
+
+def batch_concurrency(questions):
+    # More threads than the per-user limit would only wait in the scheduler
+    return max(1, min(len(questions), model.guard.scheduler.user_max_concurrent))
+
+
+def batch_job(job, content_text, questions, target_language, user=None, **kwargs):
+    # Runs on a job worker; returns (question, answer, meta) in checklist order,
+    # as far as it got if the job was cancelled
+    def answer_one(question):
+        job.check_cancelled()
+        meta = {}
+        answer = ask_question_with_gemini(
+            content_text, question, target_language, meta=meta, user=user, priority=BULK,
+            on_progress=lambda done, total: job.check_cancelled(), check_cancelled=job.check_cancelled, **kwargs
+        )
+        return answer, meta
+
+    results = [None] * len(questions)
+    pool = ThreadPoolExecutor(max_workers=batch_concurrency(questions))
+    try:
+        futures = {pool.submit(answer_one, question): i for i, question in enumerate(questions)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = (questions[i],) + future.result()
+            except JobCancelled:
+                break
+            except Exception as e:
+                # Reported in its row; the other answers are kept
+                results[i] = (questions[i], None, {"error": describe_model_error(e)})
+            job.progress = (done, len(questions))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return [result for result in results if result is not None]
+
+
+def start_question_batch(questions):
+    job_id = get_job_executor().submit(
+        batch_job,
+        st.session_state.total_content,
+        questions,
+        st.session_state.get("output_language", "English"),
+        index=st.session_state.content_index,
+        vectors=st.session_state.content_vectors,
+        content_hash=st.session_state.content_hash,
+        context=st.session_state.document_context,
+        user=st.session_state.username,
+    )
+    st.session_state.active_jobs.append({
+        "id": job_id,
+        "question": f"checklist of {len(questions)} questions",
+        "batch": len(questions),
+        "workers": batch_concurrency(questions),
+    })
+
+
+def finish_batch(active, job):
+    results = job.result or []
+    if job.status == "failed":
+        st.session_state.messages.append({
+            "role": "system",
+            "content": f"⚠️ The checklist run failed: {describe_model_error(job.error)}"
+        })
+    rows = []
+    for question, answer, meta in results:
+        st.session_state.messages.append({"role": "user", "content": question})
+        if answer is None:
+            st.session_state.messages.append({"role": "system", "content": f"⚠️ Couldn't get an answer: {meta['error']}"})
+        else:
+            st.session_state.messages.append({"role": "assistant", "content": answer, "meta": meta})
+        log_call(question, meta)
+        rows.append({
+            "Question": question,
+            "Answer": answer or "",
+            "Seconds": round(meta.get("latency", 0.0), 2),
+            "Cached": meta.get("cached", ""),
+            "Error": meta.get("error", ""),
+        })
+    st.session_state.batch_results = rows
+    if not rows:
+        return
+    elapsed = (job.finished_at or time.time()) - (job.started_at or job.submitted_at)
+    slowest = max(row["Seconds"] for row in rows)
+    failed = sum(1 for row in rows if row["Error"])
+    summary = (
+        f"Answered {len(rows) - failed} of {active['batch']} questions in {elapsed:.1f}s, "
+        f"{active['workers']} at a time (the per-user limit); slowest single answer {slowest:.1f}s."
+    )
+    if job.status == "cancelled":
+        summary = "⏹️ Checklist cancelled. " + summary
+    else:
+        summary = "✅ " + summary
+    if failed:
+        summary += f" {failed} failed, see the Error column."
+    st.session_state.messages.append({
+        "role": "system",
+        "content": summary + " Download the table from the sidebar."
+    })
+
+
+if st.session_state.get("pending_batch"):
+    batch = st.session_state.pending_batch
+    st.session_state.pending_batch = None
+    start_question_batch(batch)
+    st.rerun()
 
 # Chat input - Using on_change callback
 col1, col2 = st.columns([4, 1])
@@ -0,0 +1,109 @@
+"""
+Streaming DOCX extraction (extractors.extract_docx) against the python-docx
+object model the app used before, on a generated document. Each run happens
+in a fresh subprocess, so peak RSS is measured per extractor and not shared.
+
+    python benchmarks/bench_docx_extract.py --paragraphs 200000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+import common
+from common import report
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+WORDS = "revenue margin segment guidance dividend capital outlook board volume pricing".split()
+
+
+def make_docx(path, paragraphs, seed=3):
+    # python-docx writes the package parts; the body is generated directly,
+    # building it through python-docx would take longer than the benchmark
+    import docx
+    docx.Document().save(path)
+    rng = random.Random(seed)
+    body = []
+    tab_stops = '<w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr>'
+    for n in range(paragraphs):
+        if n % 50 == 49:
+            rows = "".join(
+                "<w:tr>" + "".join(f"<w:tc><w:p><w:r><w:t>{rng.randint(1, 9999)}</w:t></w:r></w:p></w:tc>"
+                                   for _ in range(4)) + "</w:tr>"
+                for _ in range(5)
+            )
+            body.append(f"<w:tbl>{rows}</w:tbl>")
+        text = " ".join(rng.choice(WORDS) for _ in range(25))
+        body.append(f"<w:p>{tab_stops}<w:r><w:t>{text}</w:t></w:r><w:r><w:tab/><w:t>{n}</w:t></w:r></w:p>")
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<w:document xmlns:w="{W_NS}"><w:body>{"".join(body)}</w:body></w:document>')
+
+    with zipfile.ZipFile(path) as src:
+        parts = {name: src.read(name) for name in src.namelist()}
+    parts["word/document.xml"] = document.encode("utf-8")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as dst:
+        for name, data in parts.items():
+            dst.writestr(name, data)
+
+
+def python_docx_extract(path):
+    # The extractor as it was in app.py before the streaming engine
+    import docx
+    doc = docx.Document(path)
+    return "\n".join(para.text for para in doc.paragraphs)
+
+
+def streaming_extract(path):
+    from extractors import extract_docx
+    return extract_docx(path)
+
+
+def measure(engine, path):
+    """Runs in the child process: prints seconds, peak RSS and output size."""
+    import time
+    fn = {"python-docx": python_docx_extract, "streaming": streaming_extract}[engine]
+    # Imports are not part of the comparison (extractors also pulls in pandas and fitz)
+    import docx  # noqa: F401
+    import extractors  # noqa: F401
+    base_rss = common.peak_rss_mb()
+    start = time.perf_counter()
+    text = fn(path)
+    seconds = time.perf_counter() - start
+    print(json.dumps({"seconds": seconds, "peak_rss_mb": common.peak_rss_mb(), "base_rss_mb": base_rss,
+                      "chars": len(text), "lines": text.count("\n") + 1}))
+
+
+def run_child(engine, path):
+    out = subprocess.run([sys.executable, __file__, "--child", engine, path],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=100_000)
+    parser.add_argument("--child", nargs=2, metavar=("ENGINE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return measure(*args.child)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.docx")
+        make_docx(path, args.paragraphs)
+        print(f"{args.paragraphs:,} paragraphs, {os.path.getsize(path) / 2**20:.1f} MB on disk")
+        results = {engine: run_child(engine, path) for engine in ("python-docx", "streaming")}
+
+    rows = []
+    for engine, r in results.items():
+        rows.append([engine, f"{r['seconds']:.2f}", f"{r['peak_rss_mb']:.0f}",
+                     f"{r['peak_rss_mb'] - r['base_rss_mb']:.0f}", f"{r['lines']:,}", f"{r['chars']:,}"])
+    report(rows, ["extractor", "seconds", "peak RSS MB", "RSS growth MB", "lines", "chars"])
+    print("python-docx skips tables; the streaming extractor emits their rows, hence more lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+stream_paragraphs (incremental parse, stops at MAX_PARAGRAPHS or the byte
+cap) against parse_paragraphs (whole body into BeautifulSoup) on the saved
+HTML fixtures. The response is replayed from memory in FETCH_CHUNK_SIZE
+chunks, optionally throttled to a link speed, so bytes read and download
+time show up next to parse time.
+
+    python benchmarks/bench_html_parse.py --mbps 20
+"""
+import argparse
+import glob
+import gzip
+import os
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+from common import FIXTURES, report, timed
+
+from web import FETCH_CHUNK_SIZE, parse_paragraphs, stream_paragraphs
+
+
+class ReplayedResponse:
+    """Enough of requests.Response for both paths: .text and iter_content()."""
+
+    def __init__(self, body, mbps=None):
+        self.body = body
+        self.encoding = "utf-8"
+        self.mbps = mbps
+        self.bytes_read = 0
+
+    def _wait(self, n):
+        if self.mbps:
+            time.sleep(n * 8 / (self.mbps * 1_000_000))
+
+    @property
+    def text(self):
+        self._wait(len(self.body))
+        self.bytes_read = len(self.body)
+        return self.body.decode(self.encoding)
+
+    def iter_content(self, chunk_size=FETCH_CHUNK_SIZE):
+        for start in range(0, len(self.body), chunk_size):
+            chunk = self.body[start:start + chunk_size]
+            self._wait(len(chunk))
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+def run(body, streaming, mbps):
+    response = ReplayedResponse(body, mbps)
+    text = stream_paragraphs(response) if streaming else parse_paragraphs(response.text)
+    return text, response.bytes_read
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mbps", type=float, default=None, help="simulated link speed (default: unthrottled)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.html.gz"))):
+        with gzip.open(path, "rb") as f:
+            body = f.read()
+        name = os.path.basename(path)[:-len(".html.gz")]
+        soup_s, (soup_text, soup_bytes) = timed(lambda: run(body, False, args.mbps), args.repeat)
+        stream_s, (stream_text, stream_bytes) = timed(lambda: run(body, True, args.mbps), args.repeat)
+        rows.append([
+            name, f"{len(body) / 2**20:.1f}",
+            f"{soup_s * 1000:.0f}", f"{stream_s * 1000:.0f}", f"{soup_s / stream_s:.1f}x",
+            f"{soup_bytes / 2**10:,.0f}", f"{stream_bytes / 2**10:,.0f}",
+            "yes" if soup_text == stream_text else "no",
+        ])
+    report(rows, ["fixture", "MB", "soup ms", "stream ms", "speedup", "soup KiB read", "stream KiB read",
+                  "same text"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Parallel PDF extraction (extractors.iter_pdf_pages) against the serial
+page loop app.py used before, on a generated annual-report sized PDF.
+
+    python benchmarks/bench_pdf_extract.py --pages 600 --workers 4
+"""
+import argparse
+import os
+import tempfile
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+from common import report, timed
+
+import fitz
+
+import extractors
+
+FILLER = (
+    "Revenue for the period increased on higher volumes across all segments, "
+    "while operating costs were held flat. The board proposes a final dividend "
+    "and reaffirms its guidance for the coming financial year. "
+)
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        text = f"Page {n + 1}\n" + (FILLER * 14)
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def serial_extract(data):
+    # The extractor as it was in app.py before the page-range pool
+    text = ""
+    doc = fitz.open(stream=data, filetype="pdf")
+    for page in doc:
+        text += page.get_text()
+    return text
+
+
+def parallel_extract(data):
+    return "".join(text for _, _, text in extractors.iter_pdf_pages(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--workers", type=int, default=extractors.POOL_MAX_WORKERS,
+                        help="process pool size (default: cpu count)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    extractors.POOL_MAX_WORKERS = args.workers
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.pdf")
+        make_pdf(path, args.pages)
+        with open(path, "rb") as f:
+            data = f.read()
+        print(f"{args.pages} pages, {len(data) / 2**20:.1f} MB, {args.workers} workers")
+
+        # Start the pool outside the timings; the app keeps one for the life of the process
+        if args.workers > 1:
+            extractors.get_process_pool().submit(os.getpid).result()
+
+        serial_s, serial_text = timed(lambda: serial_extract(data), args.repeat)
+        parallel_s, parallel_text = timed(lambda: parallel_extract(data), args.repeat)
+        assert serial_text == parallel_text, "extracted text differs"
+
+    report([
+        ["serial (before)", f"{serial_s:.2f}", f"{args.pages / serial_s:.0f}", "1.00x"],
+        ["iter_pdf_pages", f"{parallel_s:.2f}", f"{args.pages / parallel_s:.0f}", f"{serial_s / parallel_s:.2f}x"],
+    ], ["extractor", "seconds", "pages/s", "speedup"])
+    if args.workers < 2:
+        print("note: one worker, so iter_pdf_pages took the serial path; pass --workers to compare")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Prompt size and end-to-end latency of a question sent with the whole
+document (before) against BM25 + vector retrieval of the top chunks (after),
+on a large synthetic filing with a stubbed model whose latency grows with
+the prompt, the way a real API's input processing does.
+
+    python benchmarks/bench_retrieval.py --pages 300 --ms-per-1k-tokens 20
+"""
+import argparse
+import random
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+from common import report
+
+from llm import FakeModel, content_budget
+from retrieval import approx_tokens, build_index, retrieve_context, VectorIndex
+
+WORDS = (
+    "group segment revenue margin operating cost volume growth board period "
+    "outlook guidance capital investment market customer product region "
+    "contract pipeline employee supplier inventory pricing demand"
+).split()
+
+# One fact per question, buried at a random page of the filing
+FACTS = [
+    ("Who audits the group accounts?", "The group accounts were audited by Hallam Pryce LLP."),
+    ("What was the final dividend per share?", "The board proposes a final dividend of 41.5 pence per share."),
+    ("How many employees does the group have?", "At year end the group had 18,240 employees in 31 countries."),
+    ("What happened to the Brazilian plant?", "The Brazilian plant in Curitiba was closed after the flood in March."),
+    ("What is the net debt position?", "Net debt fell to 1.27 billion at the balance sheet date."),
+]
+
+
+def make_document(pages, seed=7):
+    rng = random.Random(seed)
+    body = []
+    for _ in range(pages):
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(14)).capitalize() + "." for _ in range(22)]
+        body.append(" ".join(sentences))
+    for (_, fact), page in zip(FACTS, rng.sample(range(pages), len(FACTS))):
+        body[page] += " " + fact
+    return "\n\n".join(body)
+
+
+class PrefillModel(FakeModel):
+    """FakeModel that also waits for the prompt, proportional to its size."""
+
+    def __init__(self, ms_per_1k_tokens, **kwargs):
+        super().__init__(chunk_delay=0.0, **kwargs)
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+
+    def generate_content(self, prompt, stream=False):
+        time.sleep(approx_tokens(prompt) / 1000 * self.ms_per_1k_tokens / 1000)
+        return super().generate_content(prompt, stream=stream)
+
+
+def make_prompt(content_text, question):
+    return f"""
+You are a helpful research assistant called EquityTool.
+Use the following content to answer the question clearly and concisely in English.
+
+Content:
+\"\"\" 
+{content_text}
+\"\"\"
+
+Question: {question}
+Answer in English:
+"""
+
+
+def ask(model, content_text, question):
+    prompt = make_prompt(content_text, question)
+    start = time.perf_counter()
+    model.generate_content(prompt)
+    return approx_tokens(prompt), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20.0,
+                        help="stub model input latency")
+    args = parser.parse_args()
+
+    document = make_document(args.pages)
+    model = PrefillModel(args.ms_per_1k_tokens)
+    print(f"{args.pages} pages, {len(document) / 2**20:.1f} MB, ~{approx_tokens(document):,} tokens")
+
+    start = time.perf_counter()
+    index = build_index(document)
+    vectors = VectorIndex.build(index.chunks)
+    load_s = time.perf_counter() - start
+    print(f"index build (once per document): {load_s:.2f}s, {len(index.chunks):,} chunks")
+
+    rows = []
+    totals = {"before": [0, 0.0], "after": [0, 0.0]}
+    hits = 0
+    for question, fact in FACTS:
+        before_tokens, before_s = ask(model, document, question)
+
+        start = time.perf_counter()
+        context = retrieve_context(index, question, vectors=vectors, token_budget=content_budget(question, ""))
+        retrieve_s = time.perf_counter() - start
+        after_tokens, after_s = ask(model, context, question)
+        after_s += retrieve_s
+        hits += fact in context
+
+        for key, tokens, seconds in (("before", before_tokens, before_s), ("after", after_tokens, after_s)):
+            totals[key][0] += tokens
+            totals[key][1] += seconds
+        rows.append([question, f"{before_tokens:,}", f"{after_tokens:,}", f"{before_s:.2f}", f"{after_s:.3f}",
+                     "yes" if fact in context else "no"])
+
+    n = len(FACTS)
+    rows.append(["mean", f"{totals['before'][0] // n:,}", f"{totals['after'][0] // n:,}",
+                 f"{totals['before'][1] / n:.2f}", f"{totals['after'][1] / n:.3f}", f"{hits}/{n}"])
+    report(rows, ["question", "tokens before", "tokens after", "s before", "s after", "fact retrieved"])
+
+
+if __name__ == "__main__":
+    main()
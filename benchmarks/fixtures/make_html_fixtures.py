@@ -0,0 +1,75 @@
+"""
+Regenerates the saved HTML fixtures. They are shaped after real heavy pages:
+inline analytics and framework bundles in the head, navigation, the article,
+then comments, related links and more scripts. Gzipped to keep the repo small.
+
+    python benchmarks/fixtures/make_html_fixtures.py
+"""
+import gzip
+import os
+import random
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORDS = (
+    "shares rose after the company reported quarterly revenue ahead of analyst "
+    "forecasts while margins narrowed on higher input costs and the chief "
+    "executive said demand in europe and asia remained resilient despite"
+).split()
+
+
+def sentence(rng, n=18):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def inline_script(rng, kb):
+    # Minified-bundle lookalike; html.parser has to scan it as raw text
+    body = ";".join(f"var _{rng.randrange(1 << 30):x}=function(a,b){{return a<b?'{rng.choice(WORDS)}':b}}"
+                    for _ in range(kb * 16))
+    return f"<script>{body[:kb * 1024]}</script>\n"
+
+
+def paragraph(rng):
+    text = " ".join(sentence(rng) for _ in range(rng.randint(2, 5)))
+    # Inline markup inside paragraphs, like links and emphasis on news sites
+    words = text.split(" ")
+    i = rng.randrange(len(words))
+    words[i] = f'<a href="/topic/{words[i].lower().strip(".")}">{words[i]}</a>'
+    return "<p>" + " ".join(words) + "</p>"
+
+
+def page(rng, head_kb, article_paragraphs, tail_kb, comments):
+    parts = ["<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Markets</title>\n"]
+    parts += [inline_script(rng, 64) for _ in range(head_kb // 64)]
+    parts.append("<style>" + ".x{color:#333}" * (head_kb * 8) + "</style></head><body>\n")
+    parts.append("<nav><ul>" + "".join(f"<li><a href='/s/{i}'>Section {i}</a></li>" for i in range(200)) + "</ul></nav>\n")
+    parts.append("<main><article><h1>Results</h1>\n")
+    parts += [paragraph(rng) + "\n" for _ in range(article_paragraphs)]
+    parts.append("</article>\n<section class='comments'>\n")
+    parts += [f"<div class='comment'><p>{sentence(rng, 30)}</p></div>\n" for _ in range(comments)]
+    parts.append("</section></main>\n")
+    parts += [inline_script(rng, 64) for _ in range(tail_kb // 64)]
+    parts.append("</body></html>\n")
+    return "".join(parts)
+
+
+FIXTURES = {
+    # Typical heavy news page: the article is near the top, megabytes of junk follow
+    "news_article.html.gz": dict(head_kb=256, article_paragraphs=70, tail_kb=1536, comments=400),
+    # Long report page: thousands of paragraphs, little script
+    "long_report.html.gz": dict(head_kb=64, article_paragraphs=6000, tail_kb=64, comments=0),
+    # Worst case for early stop: the paragraphs come after a huge head
+    "script_heavy.html.gz": dict(head_kb=1792, article_paragraphs=60, tail_kb=256, comments=50),
+}
+
+
+def main():
+    for seed, (name, shape) in enumerate(FIXTURES.items()):
+        html = page(random.Random(seed), **shape)
+        with gzip.open(os.path.join(HERE, name), "wt", encoding="utf-8", compresslevel=9) as f:
+            f.write(html)
+        print(f"{name}: {len(html.encode()) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+# ------------------ DISK CACHE ------------------
+# SQLite does the locking for us, so several Streamlit worker processes can
+# share one cache file. Entries are evicted least-recently-used once the
+# stored values go over max_bytes.
+
+CACHE_DIR = os.environ.get("EQUITYTOOL_CACHE_DIR", ".cache")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class DiskCache:
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl   # seconds since the entry was written; None keeps entries until evicted
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _connect(self):
+        # A fresh connection per call keeps this safe to use from any thread
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._count(False)
+                return default
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        self._count(True)
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now)
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def update(self, key, fn, default=None):
+        """
+        Read-modify-write in one transaction: stores and returns fn(current),
+        where current is the stored value (or default). Writers in other
+        processes wait instead of overwriting each other's changes.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            current = default
+            if row is not None and (self.ttl is None or now - row[1] <= self.ttl):
+                current = pickle.loads(row[0])
+            value = fn(current)
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now)
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return value
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        finally:
+            conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": size,
+        }
+
+
+def get_cache(name, max_bytes=256 * 1024 * 1024, ttl=None):
+    # app.py is re-run on every interaction, modules are not, so the cache
+    # objects (and their counters) live here for the life of the process
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = DiskCache(os.path.join(CACHE_DIR, f"{name}.sqlite"), max_bytes=max_bytes, ttl=ttl)
+        return _caches[name]
+
+
+# ------------------ EXTRACTION CACHE ------------------
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_upload(uploaded_file, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def extraction_key(name, version, digest):
+    return f"{name}:v{version}:{digest}"
+
+
+def cached_extractor(cache, name, version):
+    """
+    Caches an extractor's text by the hash of the uploaded bytes. Bump
+    `version` whenever the extractor's output changes so old entries are
+    never served.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(uploaded_file, *args, **kwargs):
+            key = extraction_key(name, version, hash_upload(uploaded_file))
+            text = cache.get(key)
+            if text is not None:
+                return text
+            text = func(uploaded_file, *args, **kwargs)
+            cache.set(key, text)
+            return text
+        return wrapper
+    return decorator
@@ -0,0 +1,428 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import fitz  # PDF
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# ------------------ LARGE UPLOADS ------------------
+# Uploads above the threshold are copied to a temp file in 1 MB pieces and the
+# parsers open them by path, so fitz maps pages in on demand and nothing else
+# holds a second full copy of the file in memory.
+
+SPOOL_THRESHOLD_BYTES = 32 * 1024 * 1024
+SPOOL_COPY_BUFFER = 1024 * 1024
+
+
+def _upload_size(uploaded_file):
+    size = getattr(uploaded_file, "size", None)
+    if size is None:
+        uploaded_file.seek(0, os.SEEK_END)
+        size = uploaded_file.tell()
+    return size
+
+
+@contextmanager
+def spooled_upload(uploaded_file, suffix="", threshold=SPOOL_THRESHOLD_BYTES):
+    """
+    Yields something every extractor below can open: a temp file path for
+    large uploads, the (rewound) upload itself for small ones.
+    """
+    uploaded_file.seek(0)
+    if _upload_size(uploaded_file) < threshold:
+        uploaded_file.seek(0)
+        yield uploaded_file
+        return
+
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(uploaded_file, tmp, SPOOL_COPY_BUFFER)
+        path = tmp.name
+    uploaded_file.seek(0)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def read_text(source, encoding="utf-8"):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding=encoding) as f:
+            return f.read()
+    return source.read().decode(encoding)
+
+
+# ------------------ PDF ENGINE ------------------
+# Big PDFs (annual reports are 400-900 pages) are split into page ranges and
+# handed to a process pool. Every worker opens the document on its own, fitz
+# documents can't be shared between processes.
+
+PDF_PAGES_PER_TASK = 25
+PDF_MIN_PARALLEL_PAGES = 60   # below this the pool startup costs more than it saves
+POOL_MAX_WORKERS = os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    # One pool per server process, shared by every Streamlit session
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_MAX_WORKERS)
+        return _pool
+
+
+def open_pdf(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def _extract_page_range(path, start, stop):
+    doc = fitz.open(path)
+    try:
+        return [doc[i].get_text() for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def iter_pdf_pages(source, pages_per_task=PDF_PAGES_PER_TASK, parallel=True):
+    """
+    Yields (page_number, page_count, text) for every page, in page order.
+    `source` is the raw PDF bytes, a file object or a path on disk.
+    """
+    if hasattr(source, "read"):
+        source = source.read()
+    doc = open_pdf(source)
+    page_count = doc.page_count
+
+    if not parallel or page_count < PDF_MIN_PARALLEL_PAGES or POOL_MAX_WORKERS < 2:
+        try:
+            for i, page in enumerate(doc):
+                yield i + 1, page_count, page.get_text()
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    # Workers need something they can open themselves, so bytes go to a temp file
+    tmp_path = None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(source)
+            tmp_path = tmp.name
+        path = tmp_path
+    else:
+        path = source
+
+    futures = []
+    try:
+        ranges = [(start, min(start + pages_per_task, page_count))
+                  for start in range(0, page_count, pages_per_task)]
+        pool = get_process_pool()
+        futures = [pool.submit(_extract_page_range, path, start, stop) for start, stop in ranges]
+        page_no = 0
+        # Futures are consumed in submit order, so pages come out in order even
+        # though the ranges finish in any order
+        for future in futures:
+            for text in future.result():
+                page_no += 1
+                yield page_no, page_count, text
+    finally:
+        # If the caller stops early, don't leave the rest of the ranges queued
+        for future in futures:
+            future.cancel()
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+# ------------------ DOCX ENGINE ------------------
+# Reads word/document.xml straight out of the zip with iterparse instead of
+# building the python-docx object model. Paragraphs and table rows come out in
+# document order and elements are cleared as soon as they are used, so memory
+# stays flat however long the document is.
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def iter_docx_blocks(source):
+    """
+    Yields the document's text one block at a time: a paragraph's text, or a
+    table row with its cells joined by " | " (a nested table's by " / "). `source` is a path or a
+    seekable file object.
+    """
+    with zipfile.ZipFile(source) as archive, archive.open("word/document.xml") as xml_file:
+        paragraphs = []   # stack, text boxes can nest paragraphs inside paragraphs
+        tables = []       # stack of (cells of the current row, paragraphs of the current cell)
+        open_tags = []    # ancestors of the current element
+
+        for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                open_tags.append(tag)
+                if tag == _W + "p":
+                    paragraphs.append([])
+                elif tag == _W + "tbl":
+                    tables.append(([], []))
+                continue
+            open_tags.pop()
+
+            if tag == _W + "t":
+                if paragraphs and elem.text:
+                    paragraphs[-1].append(elem.text)
+            elif tag in (_W + "tab", _W + "br", _W + "cr"):
+                # Only run content is text; w:tab also appears as a tab stop
+                # definition under w:pPr/w:tabs
+                if paragraphs and open_tags and open_tags[-1] == _W + "r":
+                    paragraphs[-1].append("\t" if tag == _W + "tab" else "\n")
+            elif tag == _W + "p":
+                text = "".join(paragraphs.pop())
+                if tables:
+                    tables[-1][1].append(text)
+                else:
+                    yield text
+                elem.clear()
+            elif tag == _W + "tc":
+                if tables:
+                    cells, cell_parts = tables[-1]
+                    cells.append(" ".join(part for part in cell_parts if part))
+                    cell_parts.clear()
+                elem.clear()
+            elif tag == _W + "tr":
+                if tables:
+                    cells = tables[-1][0]
+                    if len(tables) == 1:
+                        yield " | ".join(cells)
+                    else:
+                        # A table nested in a cell is flattened into that cell,
+                        # its cells set apart with " / " so the outer row keeps its columns
+                        tables[-2][1].append(" / ".join(cells))
+                    cells.clear()
+                elem.clear()
+            elif tag == _W + "tbl":
+                tables.pop()
+                elem.clear()
+
+
+# ------------------ CSV ENGINE ------------------
+# CSVs are read in chunks and downcast as they come in (float32, smallest int,
+# categoricals for repetitive text), so a 200 MB price history ends up as a
+# compact columnar frame. Only a short profile of it goes into the prompt.
+
+CSV_CHUNK_ROWS = 100_000
+CSV_CATEGORY_RATIO = 0.5      # object columns with fewer unique values than this share become categoricals
+CSV_SAMPLE_ROWS = 5
+CSV_MAX_GROUPS = 20
+
+
+def _downcast(chunk):
+    for col in chunk.columns:
+        series = chunk[col]
+        if pd.api.types.is_float_dtype(series):
+            chunk[col] = series.astype("float32")
+        elif pd.api.types.is_integer_dtype(series):
+            chunk[col] = pd.to_numeric(series, downcast="integer")
+        elif ((pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series))
+              and series.nunique() <= len(series) * CSV_CATEGORY_RATIO):
+            # pandas 3 reads text as StringDtype rather than object
+            chunk[col] = series.astype("category")
+    return chunk
+
+
+def _concat_chunks(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = pd.Series(union_categoricals(parts, ignore_order=True), name=col)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def load_csv_frame(source, chunksize=CSV_CHUNK_ROWS):
+    chunks = [_downcast(chunk) for chunk in pd.read_csv(source, chunksize=chunksize)]
+    if not chunks:
+        return pd.DataFrame()
+    return _concat_chunks(chunks)
+
+
+def profile_frame(df):
+    """
+    Short text description of a frame: schema, per-column stats, head/tail
+    samples and group aggregates over the first low-cardinality column.
+    """
+    lines = [f"Rows: {len(df):,} | Columns: {len(df.columns)}", "", "Schema and column stats:"]
+    numeric_cols = []
+    group_col = None
+    for col in df.columns:
+        series = df[col]
+        nulls = int(series.isna().sum())
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            numeric_cols.append(col)
+            lines.append(
+                f"- {col} ({series.dtype}): min={series.min()}, max={series.max()}, "
+                f"mean={series.mean():.4g}, std={series.std():.4g}, nulls={nulls}"
+            )
+        else:
+            counts = series.value_counts().head(3)
+            top = ", ".join(f"{value} ({count})" for value, count in counts.items())
+            unique = series.nunique()
+            lines.append(f"- {col} ({series.dtype}): unique={unique}, top={top}, nulls={nulls}")
+            if group_col is None and 1 < unique <= CSV_MAX_GROUPS:
+                group_col = col
+
+    lines += ["", f"First {CSV_SAMPLE_ROWS} rows:", df.head(CSV_SAMPLE_ROWS).to_string(index=False)]
+    lines += ["", f"Last {CSV_SAMPLE_ROWS} rows:", df.tail(CSV_SAMPLE_ROWS).to_string(index=False)]
+
+    if group_col is not None and numeric_cols:
+        grouped = df.groupby(group_col, observed=True)[numeric_cols].agg(["mean", "sum"])
+        lines += ["", f"Aggregates by {group_col}:", grouped.to_string()]
+
+    return "\n".join(lines)
+
+
+# Operators the table filter offers. Filters are built from these as boolean
+# masks; user text is only ever a value, never evaluated.
+FILTER_OPERATORS = {
+    "==": lambda series, value: series == value,
+    "!=": lambda series, value: series != value,
+    ">": lambda series, value: series > value,
+    ">=": lambda series, value: series >= value,
+    "<": lambda series, value: series < value,
+    "<=": lambda series, value: series <= value,
+    "contains": lambda series, value: series.astype(str).str.contains(str(value), case=False, regex=False, na=False),
+}
+
+
+def filter_frame(df, column, operator, value):
+    """
+    Rows of df where `column <operator> value`. The value is converted to
+    the column's type; raises ValueError if it can't be or the operator is
+    unknown.
+    """
+    if operator not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown operator: {operator}")
+    if column not in df.columns:
+        raise ValueError(f"Unknown column: {column}")
+    series = df[column]
+    if operator != "contains":
+        if pd.api.types.is_bool_dtype(series):
+            if value.strip().lower() not in ("true", "false"):
+                raise ValueError(f"{column} is true/false, got {value!r}")
+            value = value.strip().lower() == "true"
+        elif pd.api.types.is_numeric_dtype(series):
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f"{column} is numeric, got {value!r}") from None
+        else:
+            # Text and categorical columns compare as text
+            series = series.astype(str)
+    return df[FILTER_OPERATORS[operator](series, value)]
+
+
+# ------------------ EXTRACTORS ------------------
+# Plain source -> text functions. app.py wraps them with spooling and the
+# extraction cache; the batch ingestion pool calls them directly.
+
+# Bump a version whenever that extractor's output changes, it is part of the cache key
+EXTRACTOR_VERSIONS = {"pdf": 2, "docx": 4, "csv": 3, "txt": 1}
+
+
+def extract_pdf(source, on_page=None, parallel=True):
+    # on_page(page_no, page_count) is called as pages arrive, in order.
+    # Pages are separated by form feeds so normalize.py can spot headers/footers.
+    pages = []
+    for page_no, page_count, page_text in iter_pdf_pages(source, parallel=parallel):
+        pages.append(page_text)
+        if on_page:
+            on_page(page_no, page_count)
+    return "\f".join(pages)
+
+
+def extract_docx(source):
+    return "\n".join(iter_docx_blocks(source))
+
+
+def extract_csv(source):
+    return profile_frame(load_csv_frame(source))
+
+
+def extract_txt(source):
+    return read_text(source)
+
+
+QUESTION_HEADERS = {"question", "questions", "query", "queries", "prompt", "prompts", "q"}
+
+
+def read_question_list(source, csv=False):
+    """Questions from an uploaded list: one per line, or the first CSV column.
+
+    CSVs are read without a header so a plain checklist keeps its first
+    question; a first cell that is just a column name is dropped.
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if not csv:
+        return [q.strip() for q in read_text(source).splitlines() if q.strip()]
+    column = pd.read_csv(source, header=None, usecols=[0], dtype=str, skip_blank_lines=True).iloc[:, 0]
+    questions = [q.strip() for q in column.dropna() if q.strip()]
+    if questions and questions[0].lower().rstrip(":") in QUESTION_HEADERS:
+        questions = questions[1:]
+    return questions
+
+
+EXTRACTORS = {"pdf": extract_pdf, "docx": extract_docx, "csv": extract_csv, "txt": extract_txt}
+
+
+# ------------------ BATCH INGESTION ------------------
+
+def ingest_file(kind, path):
+    # Runs inside a pool worker. PDFs are extracted serially here, the pool is
+    # already busy with one file per worker.
+    start = time.perf_counter()
+    if kind == "pdf":
+        text = extract_pdf(path, parallel=False)
+    else:
+        text = EXTRACTORS[kind](path)
+    return text, time.perf_counter() - start
+
+
+def ingest_files(items, on_done=None):
+    """
+    Extracts [(kind, path), ...] on the shared process pool, one file per
+    task. Returns [(text, seconds, error), ...] in input order. on_done(index)
+    is called from the calling thread as each file finishes.
+    """
+    results = [None] * len(items)
+    pool = get_process_pool()
+    futures = {pool.submit(ingest_file, kind, path): i for i, (kind, path) in enumerate(items)}
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            text, seconds = future.result()
+            results[i] = (text, seconds, None)
+        except Exception as e:
+            results[i] = ("", 0.0, e)
+        if on_done:
+            on_done(i)
+    return results
@@ -0,0 +1,144 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from llm import percentile
+
+
+# ------------------ BACKGROUND JOBS ------------------
+# Questions run as jobs on one bounded worker pool shared by every session in
+# the process, so a Streamlit callback only has to submit and return. The UI
+# polls the job for its status and streamed text. Cancelling a queued job
+# removes it; a running one stops at its next chunk (its result is dropped
+# either way).
+
+JOB_MAX_WORKERS = 8
+JOB_KEEP_SECONDS = 60 * 60   # finished jobs nobody collected are dropped after this
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"   # queued -> running -> done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.partial = ""
+        self.progress = None     # (done, total) for multi-step jobs
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def set_partial(self, text):
+        # Used as an on_chunk callback; raising here is what stops a stream
+        self.check_cancelled()
+        self.partial = text
+
+    def set_progress(self, done, total):
+        self.check_cancelled()
+        self.progress = (done, total)
+
+
+class JobExecutor:
+    def __init__(self, max_workers=JOB_MAX_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="equitytool-job")
+        self.jobs = {}
+        self.wait_times = deque(maxlen=1000)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(job, *args, **kwargs) in the pool and returns the job id."""
+        with self._lock:
+            self._prune()
+            job = Job(f"job-{next(self._ids)}")
+            self.jobs[job.id] = job
+        job.future = self.pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        job.started_at = time.time()
+        with self._lock:
+            self.wait_times.append(job.started_at - job.submitted_at)
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+        job.status = "running"
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "cancelled" if job.cancel_requested else "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = e
+            job.status = "cancelled" if job.cancel_requested else "failed"
+        job.finished_at = time.time()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+
+    def forget(self, job_id):
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - JOB_KEEP_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def queue_position(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status != "queued":
+            return 0
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return sum(1 for j in jobs if j.status == "queued" and j.submitted_at <= job.submitted_at)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+            waits = sorted(self.wait_times)
+        return {
+            "queued": sum(1 for j in jobs if j.status == "queued"),
+            "running": sum(1 for j in jobs if j.status == "running"),
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": percentile(waits, 95),
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor()
+        return _executor
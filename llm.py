@@ -0,0 +1,1516 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+
+from cache import CACHE_DIR, get_cache
+from retrieval import embed_text, approx_tokens
+
+
+# ------------------ ANSWER CACHE ------------------
+# Answers are cached on disk by (content hash, normalized question, language,
+# model), so the same question on the same filing is answered once for the
+# whole desk. Shared by every session and worker process through SQLite.
+
+ANSWER_CACHE_TTL = 24 * 60 * 60
+ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(question):
+    # "What is the FY24 revenue? " and "what is the fy24 revenue" are the same question
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", question.strip().lower()))
+
+
+class AnswerCache:
+    def __init__(self, cache):
+        self.cache = cache
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content_hash, question, target_language, model_name):
+        return f"{content_hash}:{model_name}:{target_language}:{normalize_question(question)}"
+
+    def get(self, content_hash, question, target_language, model_name):
+        entry = self.cache.get(self.key(content_hash, question, target_language, model_name))
+        if entry is None:
+            return None
+        with self._lock:
+            self.seconds_saved += entry["latency"]
+        return entry["answer"]
+
+    def put(self, content_hash, question, target_language, model_name, answer, latency):
+        self.cache.set(
+            self.key(content_hash, question, target_language, model_name),
+            {"answer": answer, "latency": latency}
+        )
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["seconds_saved"] = self.seconds_saved
+        return stats
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(get_cache("answers", max_bytes=ANSWER_CACHE_MAX_BYTES, ttl=ANSWER_CACHE_TTL))
+        return _answer_cache
+
+
+# ------------------ SIMILAR QUESTION CACHE ------------------
+# Second tier behind the exact cache: "What was revenue in 2024?" and "2024
+# revenue?" are the same question. Questions are embedded locally and kept as
+# one float32 matrix per (content, model, language); a lookup is a single
+# matrix-vector product, well under a millisecond for thousands of questions.
+# A close vector is not enough on its own: "European segment" and "Asian
+# segment" score 0.9 with everything else equal. A match must also ask the
+# same kind of question (the wh-word, tense and negation have to agree), have
+# the same figures, share most of its content words, and only then clear the
+# cosine threshold. The question/answer lists live in their own disk cache,
+# merged on write, so other processes (and restarts) pick them up.
+
+SIMILAR_QUESTION_THRESHOLD = 0.85
+SIMILAR_QUESTION_MIN_OVERLAP = 0.75   # shared / all content words of the two questions
+SIMILAR_QUESTION_MAX = 5000     # per document, oldest dropped first
+SIMILAR_QUESTION_RELOAD = 60    # seconds before re-reading what other processes added
+SIMILAR_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_NUMBER = re.compile(r"\d[\d.,]*")
+_QUESTION_WORD = re.compile(r"[a-z0-9]+")
+_NEGATED = re.compile(r"n't\b")
+
+# Not retrieval.STOPWORDS: that list drops wh-words and auxiliaries, which
+# for questions are the difference between "when" and "why"
+QUESTION_STOPWORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "it", "its", "of", "on",
+    "or", "than", "that", "the", "then", "these", "this", "those", "to", "with",
+}
+
+# Words that change how a question is phrased, not what it asks
+QUESTION_FILLER = {
+    "about", "again", "all", "can", "could", "company", "me", "please", "show", "give",
+    "tell", "there", "us", "you", "i", "we", "like", "know", "want", "according", "document",
+    "report", "filing", "total", "overall",
+}
+
+WH_WORDS = {"what", "when", "where", "which", "who", "whom", "whose", "why", "how"}
+TENSE_WORDS = {
+    "is": "present", "are": "present", "am": "present", "do": "present", "does": "present",
+    "has": "present", "have": "present",
+    "was": "past", "were": "past", "did": "past", "had": "past",
+    "will": "future", "shall": "future",
+    "would": "conditional", "should": "conditional", "might": "conditional", "may": "conditional",
+    "be": None, "been": None, "being": None,
+}
+NEGATION_WORDS = {"not", "no", "never", "nor", "without"}
+
+
+def _numbers(question):
+    # "revenue in 2023" must never reuse the answer for "revenue in 2024"
+    return frozenset(_NUMBER.findall(question))
+
+
+def _question_words(question):
+    return _QUESTION_WORD.findall(_NEGATED.sub(" not", question.lower()))
+
+
+def question_frame(question):
+    """
+    What kind of question it is, as (wh, tense, negated). `wh` is the set of
+    wh-words, "yes/no" for "Did margins improve?", or None for a bare keyword
+    query like "2024 revenue?", which fits any kind.
+    """
+    words = _question_words(question)
+    wh = frozenset(word for word in words if word in WH_WORDS)
+    if not wh:
+        wh = frozenset({"yes/no"}) if words and words[0] in TENSE_WORDS else None
+    tense = frozenset(TENSE_WORDS[word] for word in words if TENSE_WORDS.get(word)) or None
+    return wh, tense, any(word in NEGATION_WORDS for word in words)
+
+
+def same_kind(a, b):
+    wh_a, tense_a, negated_a = a
+    wh_b, tense_b, negated_b = b
+    if negated_a != negated_b:
+        return False
+    if wh_a is not None and wh_b is not None and wh_a != wh_b:
+        return False
+    # "2024 revenue?" has no tense and goes with either
+    return tense_a is None or tense_b is None or tense_a == tense_b
+
+
+def content_words(question):
+    # Light stemming so "revenues" matches "revenue" and "plans" matches "plan"
+    words = set()
+    for word in _question_words(question):
+        if (len(word) < 2 or word.isdigit() or word in QUESTION_STOPWORDS or word in QUESTION_FILLER
+                or word in WH_WORDS or word in TENSE_WORDS or word in NEGATION_WORDS):
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+def word_overlap(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _question_vector(words):
+    # Embedded from the content words, so filler doesn't dilute the similarity
+    return embed_text(" ".join(sorted(words)), bigrams=False)
+
+
+class _QuestionSet:
+    def __init__(self, entries):
+        self.entries = []   # [{"question", "answer", "latency", "created_at"}]
+        self.numbers = []
+        self.words = []
+        self.frames = []
+        self.matrix = None
+        self.loaded_at = time.monotonic()
+        if entries:
+            self.entries = list(entries)
+            self.numbers = [_numbers(e["question"]) for e in self.entries]
+            self.words = [content_words(e["question"]) for e in self.entries]
+            self.frames = [question_frame(e["question"]) for e in self.entries]
+            self.matrix = np.vstack([_question_vector(words) for words in self.words])
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.numbers.append(_numbers(entry["question"]))
+        self.words.append(content_words(entry["question"]))
+        self.frames.append(question_frame(entry["question"]))
+        vector = _question_vector(self.words[-1])[None, :]
+        self.matrix = vector if self.matrix is None else np.vstack([self.matrix, vector])
+        if len(self.entries) > SIMILAR_QUESTION_MAX:
+            self.entries.pop(0)
+            self.numbers.pop(0)
+            self.words.pop(0)
+            self.frames.pop(0)
+            self.matrix = self.matrix[1:]
+
+    def best_match(self, question, threshold, ttl=None, min_overlap=SIMILAR_QUESTION_MIN_OVERLAP):
+        if self.matrix is None:
+            return None
+        numbers = _numbers(question)
+        words = content_words(question)
+        frame = question_frame(question)
+        scores = self.matrix @ _question_vector(words)
+        oldest = time.time() - ttl if ttl is not None else None
+        k = min(5, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Best first, skipping candidates that ask about something else or have expired
+        for i in top[np.argsort(-scores[top])]:
+            if scores[i] < threshold:
+                break
+            if self.numbers[i] != numbers or not same_kind(self.frames[i], frame):
+                continue
+            if word_overlap(self.words[i], words) < min_overlap:
+                continue
+            if oldest is not None and self.entries[i].get("created_at", 0.0) < oldest:
+                continue
+            return self.entries[i], float(scores[i])
+        return None
+
+
+def _merge_entries(stored, entry, ttl):
+    # Runs inside the cache transaction: keeps what other processes wrote
+    oldest = time.time() - ttl if ttl is not None else None
+    question = normalize_question(entry["question"])
+    entries = [
+        e for e in (stored or [])
+        if normalize_question(e["question"]) != question
+        and (oldest is None or e.get("created_at", 0.0) >= oldest)
+    ]
+    entries.append(entry)
+    return entries[-SIMILAR_QUESTION_MAX:]
+
+
+class SimilarQuestionCache:
+    def __init__(self, cache, threshold=SIMILAR_QUESTION_THRESHOLD, ttl=ANSWER_CACHE_TTL):
+        self.cache = cache
+        self.threshold = threshold
+        self.ttl = ttl   # per question; the disk entry only expires when nobody adds to it
+        self.hits = 0
+        self.seconds_saved = 0.0
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content_hash, target_language, model_name):
+        return f"similar:{content_hash}:{model_name}:{target_language}"
+
+    def _set(self, key):
+        # Caller holds the lock
+        questions = self._sets.get(key)
+        if questions is None or time.monotonic() - questions.loaded_at > SIMILAR_QUESTION_RELOAD:
+            questions = self._sets[key] = _QuestionSet(self.cache.get(key, []))
+        return questions
+
+    def get(self, content_hash, question, target_language, model_name):
+        """Returns (answer, matched_question, similarity) or None."""
+        with self._lock:
+            questions = self._set(self.key(content_hash, target_language, model_name))
+            match = questions.best_match(question, self.threshold, self.ttl)
+            if match is None:
+                return None
+            entry, similarity = match
+            self.hits += 1
+            self.seconds_saved += entry["latency"]
+        return entry["answer"], entry["question"], similarity
+
+    def put(self, content_hash, question, target_language, model_name, answer, latency):
+        key = self.key(content_hash, target_language, model_name)
+        entry = {"question": question, "answer": answer, "latency": latency, "created_at": time.time()}
+        self.cache.update(key, lambda stored: _merge_entries(stored, entry, self.ttl), default=[])
+        with self._lock:
+            # Other processes' additions arrive with the next reload
+            if key in self._sets:
+                self._sets[key].add(entry)
+
+
+_similar_cache = None
+
+
+def get_similar_cache():
+    global _similar_cache
+    with _answer_cache_lock:
+        if _similar_cache is None:
+            # Its own file, so loading question lists doesn't count against the exact cache's hit rate
+            _similar_cache = SimilarQuestionCache(
+                get_cache("similar_questions", max_bytes=SIMILAR_CACHE_MAX_BYTES, ttl=ANSWER_CACHE_TTL)
+            )
+        return _similar_cache
+
+
+# ------------------ SINGLE-FLIGHT ------------------
+# When several people ask the same thing about the same document within
+# seconds, only the first request calls the model. The others wait for that
+# call (following its streamed text, if it streams) and share its answer; the
+# answer cache then covers everyone who asks after it has finished.
+
+SINGLE_FLIGHT_POLL_SECONDS = 0.1
+
+
+def single_flight_key(content_hash, question, target_language, model_name, history=""):
+    history_digest = hashlib.sha256(history.encode("utf-8")).hexdigest()[:16] if history else ""
+    return f"{AnswerCache.key(content_hash, question, target_language, model_name)}:{history_digest}"
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.partial = ""
+        self.meta = {}
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0        # calls that actually ran
+        self.coalesced = 0    # calls that waited on one of those instead
+        self.seconds_saved = 0.0
+
+    def do(self, key, fn, on_update=None, check_cancelled=None):
+        """
+        Runs fn(flight) unless a call with the same key is already running,
+        in which case that call's result is waited for and shared. Returns
+        (result, flight, shared). on_update(partial_text) is called while
+        waiting whenever the leading call publishes more text in
+        flight.partial. If the leading call raises, a waiting caller runs fn
+        itself instead of inheriting the error. check_cancelled() is called
+        while waiting; whatever it raises ends the wait.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                    self.calls += 1
+            if leader:
+                break
+            seen = ""
+            while not flight.done.wait(SINGLE_FLIGHT_POLL_SECONDS):
+                if check_cancelled is not None:
+                    # Only this waiter stops; the leading call goes on for the others
+                    check_cancelled()
+                if on_update is not None and flight.partial != seen:
+                    seen = flight.partial
+                    on_update(seen)
+            if not flight.failed:
+                with self._lock:
+                    self.coalesced += 1
+                    self.seconds_saved += flight.meta.get("latency", 0.0)
+                return flight.result, flight, True
+
+        try:
+            flight.result = fn(flight)
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, flight, False
+
+    def stats(self):
+        with self._lock:
+            requests = self.calls + self.coalesced
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+                "coalesced_rate": self.coalesced / requests if requests else 0.0,
+                "seconds_saved": self.seconds_saved,
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
+
+
+# ------------------ FAKE MODEL ------------------
+# Offline stand-in for genai.GenerativeModel, same generate_content() shape
+# (a response with .text, or an iterator of chunks with stream=True). Set
+# EQUITYTOOL_FAKE_MODEL=1 to run the app without an API key.
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    def __init__(self, model_name="fake-model", chunk_delay=0.05, words_per_chunk=3):
+        self.model_name = model_name
+        self.chunk_delay = chunk_delay
+        self.words_per_chunk = words_per_chunk
+
+    def answer_for(self, prompt):
+        question = prompt.rsplit("Question:", 1)[-1].split("\n", 1)[0].strip()
+        return f"This is a fake answer to: {question}"
+
+    def _chunks(self, text):
+        words = text.split(" ")
+        for i in range(0, len(words), self.words_per_chunk):
+            time.sleep(self.chunk_delay)
+            yield FakeResponse(" ".join(words[i:i + self.words_per_chunk]) + " ")
+
+    def generate_content(self, prompt, stream=False):
+        text = self.answer_for(prompt)
+        if stream:
+            return self._chunks(text)
+        time.sleep(self.chunk_delay * max(1, len(text.split(" ")) // self.words_per_chunk))
+        return FakeResponse(text)
+
+
+# ------------------ PROVIDER CONTEXT CACHE ------------------
+# A loaded document is registered once with the provider as cached context;
+# questions then reference the cache handle instead of re-sending the text.
+# Backends only need create/refresh/delete/model_for, so the fake below can
+# stand in for Gemini. Anything that goes wrong falls back to inline prompts.
+
+CONTEXT_CACHE_TTL = 30 * 60
+CONTEXT_CACHE_REFRESH_MARGIN = 5 * 60   # extend the TTL when less than this is left
+CONTEXT_CACHE_MIN_TOKENS = 4096         # the API refuses to cache anything smaller
+
+CONTEXT_SYSTEM_INSTRUCTION = (
+    "You are a helpful research assistant called EquityTool. "
+    "Answer questions using the document provided in this context."
+)
+
+
+class GeminiContextCaches:
+    def __init__(self, model_name, system_instruction=CONTEXT_SYSTEM_INSTRUCTION):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def create(self, content_text, ttl):
+        return caching.CachedContent.create(
+            model=f"models/{self.model_name}",
+            display_name="equitytool-document",
+            system_instruction=self.system_instruction,
+            contents=[content_text],
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+
+    def refresh(self, handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def model_for(self, handle):
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+
+class FakeContextCaches:
+    def __init__(self, model_name="fake-model"):
+        self.model_name = model_name
+        self.handles = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def create(self, content_text, ttl):
+        with self._lock:
+            self._next_id += 1
+            handle = f"cachedContents/fake-{self._next_id}"
+            self.handles[handle] = {"content": content_text, "ttl": ttl, "refreshes": 0}
+        return handle
+
+    def refresh(self, handle, ttl):
+        if handle not in self.handles:
+            raise LookupError(f"{handle} has expired")
+        self.handles[handle]["ttl"] = ttl
+        self.handles[handle]["refreshes"] += 1
+
+    def delete(self, handle):
+        self.handles.pop(handle, None)
+
+    def model_for(self, handle):
+        if handle not in self.handles:
+            raise LookupError(f"{handle} has expired")
+        return FakeModel(self.model_name)
+
+
+class DocumentContext:
+    def __init__(self, backend, content_text, ttl=CONTEXT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.handle = None
+        self.expires_at = 0.0
+        self.error = None
+        try:
+            self.handle = backend.create(content_text, ttl)
+            self.expires_at = time.time() + ttl
+        except Exception as e:
+            self.error = e
+
+    @property
+    def active(self):
+        return self.handle is not None
+
+    def model(self):
+        """The model bound to the cached document, or None to go inline."""
+        if self.handle is None:
+            return None
+        try:
+            if time.time() > self.expires_at - CONTEXT_CACHE_REFRESH_MARGIN:
+                self.backend.refresh(self.handle, self.ttl)
+                self.expires_at = time.time() + self.ttl
+            return self.backend.model_for(self.handle)
+        except Exception as e:
+            # Expired or deleted on the provider side: stop using it
+            self.error = e
+            self.handle = None
+            return None
+
+    def discard(self, error):
+        """A call on the cached model failed: go inline from now on instead of paying for it again."""
+        self.error = error
+        self.close()
+
+    def close(self):
+        if self.handle is not None:
+            try:
+                self.backend.delete(self.handle)
+            except Exception:
+                pass   # it expires on its own anyway
+            self.handle = None
+
+
+class ModelContexts:
+    """
+    The document's provider cache for each model. A cache belongs to one
+    model, so each is created the first time a question is routed to it.
+    """
+
+    def __init__(self, backends, content_text, ttl=CONTEXT_CACHE_TTL):
+        self.backends = backends   # model name -> context cache backend
+        self.content_text = content_text
+        self.ttl = ttl
+        self.contexts = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name):
+        # Held while creating, so concurrent questions don't register the document twice
+        with self._lock:
+            if model_name not in self.contexts and model_name in self.backends:
+                self.contexts[model_name] = DocumentContext(self.backends[model_name], self.content_text, self.ttl)
+            return self.contexts.get(model_name)
+
+    @property
+    def active(self):
+        return any(context.active for context in list(self.contexts.values()))
+
+    def close(self):
+        with self._lock:
+            for context in self.contexts.values():
+                context.close()
+            self.contexts = {}
+
+
+# ------------------ TOKEN BUDGET ------------------
+# Every prompt is sized before it is sent. Content, question and history are
+# estimated at ~4 characters per token; if they don't fit the per-call budget
+# the content is narrowed to the best chunks and, failing that, trimmed.
+
+PROMPT_TOKEN_BUDGET = 8000
+PROMPT_OVERHEAD_TOKENS = 80   # the instructions wrapped around content and question
+
+
+def trim_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    if cut < max_chars // 2:
+        cut = max_chars
+    return text[:cut] + "\n[... content trimmed to fit the token budget ...]"
+
+
+def content_budget(question, history=""):
+    # Tokens left for content once the instructions, question and history are in
+    return max(0, PROMPT_TOKEN_BUDGET - PROMPT_OVERHEAD_TOKENS - approx_tokens(question) - approx_tokens(history))
+
+
+def sent_prompt_tokens(content_tokens, question, history="", map_reduce=False):
+    """
+    Estimated tokens actually sent to answer one question: the content is
+    narrowed to the budget, except in map-reduce mode, which sends all of it.
+    """
+    budget = content_budget(question, history)
+    if not (map_reduce and content_tokens > budget):
+        content_tokens = min(content_tokens, budget)
+    return PROMPT_OVERHEAD_TOKENS + approx_tokens(question) + approx_tokens(history) + content_tokens
+
+
+def usage_tokens(usage, prompt, answer):
+    """(input_tokens, output_tokens, estimated) from the response usage metadata if there is any."""
+    if usage is not None and getattr(usage, "prompt_token_count", None):
+        return usage.prompt_token_count, getattr(usage, "candidates_token_count", 0) or 0, False
+    return approx_tokens(prompt), approx_tokens(answer), True
+
+
+class UsageTotals:
+    """Sums usage_tokens() over several calls, e.g. the map and reduce calls behind one answer."""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.estimated = False
+        self._lock = threading.Lock()
+
+    def add(self, response, prompt):
+        tokens_in, tokens_out, estimated = usage_tokens(getattr(response, "usage_metadata", None), prompt, response.text)
+        with self._lock:
+            self.input_tokens += tokens_in
+            self.output_tokens += tokens_out
+            self.estimated = self.estimated or estimated
+
+    def totals(self):
+        with self._lock:
+            return self.input_tokens, self.output_tokens, self.estimated
+
+
+# ------------------ CONVERSATION MEMORY ------------------
+# Follow-up questions ("and the year before?") need the earlier turns. The
+# last few turns are kept verbatim; each turn that falls out of that window is
+# folded into a running summary by one small model call, so the history sent
+# with a question stays bounded however long the conversation gets. Only
+# follow-ups are sent with history: a standalone question means the same thing
+# in any conversation, so it stays cacheable and coalescable.
+
+MEMORY_KEEP_TURNS = 3
+MEMORY_TURN_MAX_TOKENS = 300      # answers kept verbatim are trimmed to this
+MEMORY_SUMMARY_MAX_TOKENS = 300
+
+_FOLLOW_UP = re.compile(
+    r"^\s*(and|also|but|so|what about|how about|same)\b"
+    r"|\b(it|its|it's|this|that|these|those|they|them|their|he|she|his|her|above|"
+    r"previous(ly)?|prior|earlier|before|last one|same|former|latter|mentioned|you said)\b",
+    re.IGNORECASE
+)
+
+
+def is_follow_up(question):
+    # Errs towards "follow-up": that only costs a cache hit, the other way costs a wrong answer
+    return bool(_FOLLOW_UP.search(question))
+
+
+def summary_prompt(summary, question, answer):
+    return f"""
+You keep a running summary of a conversation between a user and EquityTool, a research assistant.
+Update the summary with the exchange below. Keep names, figures, periods and anything a follow-up question could refer to.
+Reply with the updated summary only, in at most {MEMORY_SUMMARY_MAX_TOKENS * 3 // 4} words.
+
+Summary so far:
+\"\"\"
+{summary or "(empty)"}
+\"\"\"
+
+User: {question}
+EquityTool: {answer}
+"""
+
+
+class ConversationMemory:
+    def __init__(self, keep_turns=MEMORY_KEEP_TURNS, turn_max_tokens=MEMORY_TURN_MAX_TOKENS,
+                 summary_max_tokens=MEMORY_SUMMARY_MAX_TOKENS):
+        self.keep_turns = keep_turns
+        self.turn_max_tokens = turn_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.turns = deque()   # (question, answer), oldest first
+        self.summary = ""
+        self.folded_turns = 0
+        self._lock = threading.Lock()
+        self._fold_lock = threading.Lock()   # one fold at a time; readers never wait on the model
+
+    def add_turn(self, question, answer):
+        """Records one exchange. Call fold() afterwards (off the UI thread) if needs_fold."""
+        with self._lock:
+            self.turns.append((question, trim_to_tokens(answer, self.turn_max_tokens)))
+
+    @property
+    def needs_fold(self):
+        return len(self.turns) > self.keep_turns
+
+    def fold(self, summarize=None):
+        """
+        Folds the turns past the verbatim window into the summary.
+        summarize(prompt) -> text is the model call; without it, or if it
+        fails, the old turn is appended to the summary as is (and trimmed).
+        A turn stays verbatim until its fold is done, so render() never
+        loses it in between.
+        """
+        with self._fold_lock:
+            while True:
+                with self._lock:
+                    if len(self.turns) <= self.keep_turns:
+                        return
+                    oldest = self.turns[0]
+                    summary = self.summary
+                old_question, old_answer = oldest
+                new_summary = None
+                if summarize is not None:
+                    try:
+                        new_summary = summarize(summary_prompt(summary, old_question, old_answer)).strip()
+                    except Exception as e:
+                        print(f"Conversation summary failed, keeping the turn as is: {e}")
+                if not new_summary:
+                    new_summary = f"{summary}\nUser asked: {old_question}\nEquityTool: {old_answer}".strip()
+                with self._lock:
+                    if not self.turns or self.turns[0] is not oldest:
+                        return   # cleared while the model was summarizing
+                    self.turns.popleft()
+                    self.summary = trim_to_tokens(new_summary, self.summary_max_tokens)
+                    self.folded_turns += 1
+
+    def render(self):
+        with self._lock:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+            for question, answer in self.turns:
+                parts.append(f"User: {question}\nEquityTool: {answer}")
+        return "\n\n".join(parts)
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.summary = ""
+            self.folded_turns = 0
+
+
+# ------------------ RATE LIMITING ------------------
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, bursts of up to
+    `capacity`. acquire() blocks until the tokens are there (or timeout).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        # Never blocks: 0.0 if the tokens were taken, else the seconds until they will be there
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def per_minute_limiter(requests_per_minute, burst):
+    return TokenBucket(requests_per_minute / 60.0, max(1, min(burst, requests_per_minute)))
+
+
+# ------------------ MAP-REDUCE ANSWERS ------------------
+# For documents far bigger than one prompt: every group of chunks is asked
+# the question on its own (map, concurrently), then one more call combines
+# the partial answers (reduce). `generate` is any prompt -> text callable.
+
+MAP_MAX_CONCURRENCY = 4
+MAP_REQUESTS_PER_MINUTE = 60
+MAP_GROUP_TOKENS = 6000
+NOTHING_FOUND = "NONE"
+
+
+def group_chunks(chunks, max_tokens=MAP_GROUP_TOKENS):
+    groups = []
+    current = []
+    size = 0
+    for chunk in chunks:
+        cost = approx_tokens(chunk)
+        if current and size + cost > max_tokens:
+            groups.append("\n".join(current))
+            current, size = [], 0
+        current.append(chunk)
+        size += cost
+    if current:
+        groups.append("\n".join(current))
+    return groups
+
+
+def history_block(history):
+    return f"Conversation so far:\n\"\"\"\n{history}\n\"\"\"\n" if history else ""
+
+
+def map_prompt(part, question, target_language, history=""):
+    return f"""
+You are a helpful research assistant called EquityTool.
+Below is one part of a larger document. Extract everything in it that helps answer the question, in {target_language}.
+If this part contains nothing relevant, reply with exactly {NOTHING_FOUND}.
+
+Part:
+\"\"\"
+{part}
+\"\"\"
+
+{history_block(history)}Question: {question}
+"""
+
+
+def reduce_prompt(partials, question, target_language, history=""):
+    notes = "\n\n".join(f"[Part {i + 1}]\n{partial}" for i, partial in enumerate(partials))
+    return f"""
+You are a helpful research assistant called EquityTool.
+These notes were extracted from different parts of one document. Combine them into one clear and concise answer in {target_language}.
+
+Notes:
+\"\"\"
+{notes}
+\"\"\"
+
+{history_block(history)}Question: {question}
+Answer in {target_language}:
+"""
+
+
+def map_reduce_answer(generate, chunks, question, target_language="English",
+                      max_concurrency=MAP_MAX_CONCURRENCY, limiter=None, on_progress=None, stats=None,
+                      history=""):
+    """
+    Returns the combined answer. `history` (ConversationMemory.render()) is
+    sent with every map and reduce call so follow-ups resolve. on_progress(done, total) is called from the
+    calling thread after each map call; if it raises (a cancelled job), the
+    map calls not started yet are dropped and the exception is passed on
+    without waiting for the ones in flight. `stats`, if given, gets the call
+    count, wall time and the summed per-call time (what running the map calls
+    one after the other would have cost).
+    """
+    stats = stats if stats is not None else {}
+    limiter = limiter or per_minute_limiter(MAP_REQUESTS_PER_MINUTE, max_concurrency)
+    groups = group_chunks(chunks)
+
+    stopped = threading.Event()
+
+    def run(prompt):
+        limiter.acquire()
+        if stopped.is_set():
+            return None, 0.0
+        start = time.perf_counter()
+        text = generate(prompt)
+        return text, time.perf_counter() - start
+
+    partials = [None] * len(groups)
+    call_seconds = 0.0
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures = {pool.submit(run, map_prompt(group, question, target_language, history)): i for i, group in enumerate(groups)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            partials[futures[future]], seconds = future.result()
+            call_seconds += seconds
+            if on_progress:
+                on_progress(done, len(groups))
+    except BaseException:
+        # Cancelled, or a part failed: the remaining parts would be paid for and thrown away
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    stats["map_calls"] = len(groups)
+    stats["map_seconds"] = time.perf_counter() - start
+    stats["map_sequential_seconds"] = call_seconds
+
+    # Keep document order, drop the parts that had nothing to say
+    partials = [p.strip() for p in partials if p and p.strip() != NOTHING_FOUND]
+    if not partials:
+        partials = [NOTHING_FOUND]
+
+    # Too many notes for one reduce call: fold them in groups until they fit
+    while len(partials) > 1 and sum(approx_tokens(p) for p in partials) > MAP_GROUP_TOKENS:
+        folded = []
+        for group in group_chunks(partials):
+            folded.append(run(reduce_prompt([group], question, target_language, history))[0])
+        if len(folded) >= len(partials):
+            break
+        partials = folded
+
+    return run(reduce_prompt(partials, question, target_language, history))[0]
+
+
+# ------------------ FAIR SCHEDULING ------------------
+# Model calls from every session queue here before they go out, so one user's
+# long checklist can't starve everyone else on the server. Each user has a
+# queue per priority. Interactive questions always go before bulk work; within
+# a priority the user with the least weighted service so far goes next
+# (start-time fair queuing, charged in prompt tokens). Each user is also
+# capped on concurrent calls and on prompt tokens per minute.
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)   # dequeued strictly in this order
+
+SCHED_MAX_CONCURRENT = 16
+SCHED_CANCEL_POLL_SECONDS = 0.2   # how often a queued call checks whether its job was cancelled
+USER_MAX_CONCURRENT = 4
+USER_TOKENS_PER_MINUTE = 250_000
+ANONYMOUS_USER = "anonymous"
+
+
+class _UserQueue:
+    def __init__(self, weight, tokens_per_minute):
+        self.weight = weight
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.running = 0
+        self.vtime = 0.0   # weighted service received so far
+        self.quota = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+        self.calls = 0
+        self.tokens = 0
+
+    @property
+    def idle(self):
+        return self.running == 0 and not any(self.queues.values())
+
+
+def parse_user_weights(spec):
+    """
+    "alice=2,reports-bot=0.5" -> ({"alice": 2.0, "reports-bot": 0.5}, rejected),
+    where `rejected` lists the entries that aren't user=positive-number.
+    """
+    weights = {}
+    rejected = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        user, _, weight = entry.partition("=")
+        try:
+            value = float(weight)
+        except ValueError:
+            value = None
+        if not user.strip() or value is None or not 0 < value < float("inf"):
+            rejected.append(entry)
+            continue
+        weights[user.strip()] = value
+    return weights, rejected
+
+
+class SchedulerTicket:
+    def __init__(self, user, priority, tokens):
+        self.user = user
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class FairScheduler:
+    def __init__(self, max_concurrent=SCHED_MAX_CONCURRENT, user_max_concurrent=USER_MAX_CONCURRENT,
+                 user_tokens_per_minute=USER_TOKENS_PER_MINUTE):
+        self.max_concurrent = max_concurrent
+        self.user_max_concurrent = user_max_concurrent
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.weights = {}
+        self.users = {}
+        self.running = 0
+        self.vtime = 0.0   # start tag of the latest call let through
+        self._retry_in = None
+        self._cond = threading.Condition()
+
+    def set_weight(self, user, weight):
+        weight = float(weight)
+        if not 0 < weight < float("inf"):
+            raise ValueError(f"scheduler weight for {user!r} must be a positive number, got {weight}")
+        with self._cond:
+            self.weights[user] = weight
+            if user in self.users:
+                self.users[user].weight = weight
+
+    def _user(self, user):
+        state = self.users.get(user)
+        if state is None:
+            state = self.users[user] = _UserQueue(self.weights.get(user, 1.0), self.user_tokens_per_minute)
+        return state
+
+    def acquire(self, user, priority=INTERACTIVE, tokens=1, check_cancelled=None):
+        """
+        Blocks until the call may go out. Pass the returned ticket to
+        release() when it is done. check_cancelled() is called while
+        waiting; if it raises, the call leaves the queue and the error is
+        passed on.
+        """
+        user = user or ANONYMOUS_USER
+        with self._cond:
+            state = self._user(user)
+            if state.idle:
+                # Time spent away doesn't bank credit to burst past everyone later
+                state.vtime = max(state.vtime, self.vtime)
+            ticket = SchedulerTicket(user, priority, max(1, min(tokens, self.user_tokens_per_minute)))
+            state.queues[priority].append(ticket)
+            while True:
+                self._dispatch()
+                if ticket.granted:
+                    return ticket
+                timeout = self._retry_in
+                if check_cancelled is not None:
+                    try:
+                        check_cancelled()
+                    except BaseException:
+                        state.queues[priority].remove(ticket)
+                        self._cond.notify_all()
+                        raise
+                    timeout = min(timeout or SCHED_CANCEL_POLL_SECONDS, SCHED_CANCEL_POLL_SECONDS)
+                # Woken by release(); the timeout covers quotas refilling
+                self._cond.wait(timeout=timeout)
+
+    def release(self, ticket):
+        with self._cond:
+            self.users[ticket.user].running -= 1
+            self.running -= 1
+            self._dispatch()
+            # Waiters held back by a quota re-check theirs too
+            self._cond.notify_all()
+
+    def _dispatch(self):
+        # Caller holds the lock. Lets queued calls through while there is room.
+        granted = False
+        self._retry_in = None
+        while self.running < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            state = self.users[ticket.user]
+            state.queues[ticket.priority].popleft()
+            state.running += 1
+            self.running += 1
+            self.vtime = max(self.vtime, state.vtime)
+            state.vtime += ticket.tokens / state.weight
+            state.waits[ticket.priority].append(time.monotonic() - ticket.enqueued_at)
+            state.calls += 1
+            state.tokens += ticket.tokens
+            ticket.granted = granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _next_ticket(self):
+        for priority in PRIORITIES:
+            candidates = [
+                state for state in self.users.values()
+                if state.queues[priority] and state.running < self.user_max_concurrent
+            ]
+            for state in sorted(candidates, key=lambda state: state.vtime):
+                ticket = state.queues[priority][0]
+                wait = state.quota.try_acquire(ticket.tokens)
+                if not wait:
+                    return ticket
+                self._retry_in = wait if self._retry_in is None else min(self._retry_in, wait)
+        return None
+
+    def stats(self):
+        """Per user: queued and running calls, calls and prompt tokens so far, and queue wait per priority."""
+        with self._cond:
+            users = {}
+            for user, state in self.users.items():
+                row = {
+                    "queued": sum(len(queue) for queue in state.queues.values()),
+                    "running": state.running,
+                    "calls": state.calls,
+                    "tokens": state.tokens,
+                    "weight": state.weight,
+                }
+                for priority in PRIORITIES:
+                    waits = sorted(state.waits[priority])
+                    row[f"{priority}_wait_avg"] = sum(waits) / len(waits) if waits else 0.0
+                    row[f"{priority}_wait_p95"] = percentile(waits, 95)
+                users[user] = row
+            return users
+
+
+# ------------------ RESILIENT CLIENT ------------------
+# Every model call goes through ResilientModel: the fair scheduler, a
+# process-wide token bucket (shared by all sessions), retries with jittered exponential backoff for
+# throttling/outage errors, and a circuit breaker that fails fast while the
+# provider is down instead of piling up doomed requests.
+
+LLM_REQUESTS_PER_MINUTE = 300
+LLM_BURST = 20
+LLM_MAX_ATTEMPTS = 4
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 20.0
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+_RETRYABLE = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def is_retryable(error):
+    return isinstance(error, _RETRYABLE) or getattr(error, "code", None) in (429, 500, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        # Half-open lets a single trial call through; its result decides, and
+        # everyone else is turned away until it is in
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        # The call ended without saying anything about the provider (cancelled,
+        # or an error that isn't an outage): let the next caller probe instead
+        with self._lock:
+            self._probing = False
+
+
+class ClientMetrics:
+    def __init__(self, keep=1000):
+        self.attempts = deque(maxlen=keep)   # {"latency", "ok", "error", "attempt"}
+        self.retries = 0
+        self.rejected = 0                    # failed fast by the breaker
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok, error=None, attempt=1):
+        with self._lock:
+            self.attempts.append({"latency": latency, "ok": ok, "error": error, "attempt": attempt})
+            if attempt > 1:
+                self.retries += 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+        with self._lock:
+            attempts = list(self.attempts)
+        latencies = sorted(a["latency"] for a in attempts if a["ok"])
+        return {
+            "attempts": len(attempts),
+            "errors": sum(1 for a in attempts if not a["ok"]),
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+        }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+class ProviderGuard:
+    # The shared part: one per process, used by every session's ResilientModel
+    def __init__(self):
+        self.limiter = TokenBucket(LLM_REQUESTS_PER_MINUTE / 60.0, LLM_BURST)
+        self.breaker = CircuitBreaker()
+        self.metrics = ClientMetrics()
+        self.scheduler = FairScheduler()
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_provider_guard():
+    global _guard
+    with _guard_lock:
+        if _guard is None:
+            _guard = ProviderGuard()
+        return _guard
+
+
+class ResilientModel:
+    """
+    Drop-in wrapper around a model's generate_content(). Calls are queued in
+    the scheduler under `user` at `priority`; for_user() gives a copy bound to
+    another user, and to a job's check_cancelled so a cancelled job stops
+    waiting for its turn.
+    """
+
+    def __init__(self, model, guard=None, max_attempts=LLM_MAX_ATTEMPTS, user=None, priority=INTERACTIVE,
+                 check_cancelled=None):
+        self.model = model
+        self.guard = guard or get_provider_guard()
+        self.max_attempts = max_attempts
+        self.user = user
+        self.priority = priority
+        self.check_cancelled = check_cancelled   # raises once the caller's job is cancelled
+
+    def for_user(self, user, priority=INTERACTIVE, check_cancelled=None):
+        return ResilientModel(self.model, self.guard, self.max_attempts, user, priority, check_cancelled)
+
+    def _backoff(self, attempt):
+        # Full jitter: spread retries out so throttled clients don't retry in lockstep
+        time.sleep(random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** (attempt - 1))))
+
+    def generate_content(self, prompt, stream=False):
+        guard = self.guard
+        # Retries count against the per-minute quota only once
+        tokens = approx_tokens(prompt) if isinstance(prompt, str) else 1
+        for attempt in range(1, self.max_attempts + 1):
+            if self.check_cancelled is not None:
+                self.check_cancelled()
+            if not guard.breaker.allow():
+                guard.metrics.reject()
+                raise CircuitOpenError(
+                    f"The model provider is failing; not calling it for another {guard.breaker.retry_after():.0f}s"
+                )
+            try:
+                ticket = guard.scheduler.acquire(self.user, self.priority, tokens if attempt == 1 else 1,
+                                                 check_cancelled=self.check_cancelled)
+            except BaseException:
+                guard.breaker.release_probe()
+                raise
+            guard.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.model.generate_content(prompt, stream=stream)
+                if stream:
+                    # Errors usually come before the first chunk; only that part is retried
+                    chunks = iter(response)
+                    first = next(chunks, None)
+            except Exception as e:
+                guard.scheduler.release(ticket)
+                if not self._failed(e, start, attempt) or attempt == self.max_attempts:
+                    raise
+                self._backoff(attempt)
+                continue
+            except BaseException:
+                guard.scheduler.release(ticket)
+                guard.breaker.release_probe()
+                raise
+            if stream:
+                # The outcome and latency are recorded once the stream has been read
+                return self._resume(first, chunks, ticket, start, attempt)
+            guard.scheduler.release(ticket)
+            self._succeeded(start, attempt)
+            return response
+
+    def _succeeded(self, start, attempt):
+        self.guard.metrics.record(time.perf_counter() - start, True, None, attempt)
+        self.guard.breaker.record_success()
+
+    def _failed(self, error, start, attempt):
+        """Records a failed attempt; True if it is worth retrying."""
+        self.guard.metrics.record(time.perf_counter() - start, False, type(error).__name__, attempt)
+        if not is_retryable(error):
+            self.guard.breaker.release_probe()
+            return False
+        self.guard.breaker.record_failure()
+        return True
+
+    def _resume(self, first, chunks, ticket, start, attempt):
+        # The scheduler slot is held until the stream has been read
+        recorded = False
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+            recorded = True
+            self._succeeded(start, attempt)
+        except Exception as e:
+            # Too late to retry: the caller already has part of the answer
+            recorded = True
+            self._failed(e, start, attempt)
+            raise
+        finally:
+            self.guard.scheduler.release(ticket)
+            if not recorded:
+                # Closed early by the reader (a cancelled job)
+                self.guard.breaker.release_probe()
+
+
+class FaultyModel:
+    """
+    Fault-injecting wrapper for local runs: fails a share of calls with the
+    errors the provider returns under load, and can add latency.
+    """
+
+    def __init__(self, model, failure_rate=0.3, extra_latency=0.0, seed=None,
+                 errors=(google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable), fail_first=0):
+        self.model = model
+        self.failure_rate = failure_rate
+        self.extra_latency = extra_latency
+        self.errors = errors
+        self.fail_first = fail_first   # the first n calls always fail, for deterministic tests
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        time.sleep(self.extra_latency)
+        if self.calls <= self.fail_first or self.random.random() < self.failure_rate:
+            raise self.random.choice(self.errors)("injected fault")
+        return self.model.generate_content(prompt, stream=stream)
+
+
+# ------------------ MODEL ROUTING ------------------
+# Lookups ("what was Q3 revenue?") go to the fast model; analysis questions,
+# big prompts and anything asked with "deep analysis" on go to the heavy one.
+# Prompt size is what is really sent (see sent_prompt_tokens): one question's
+# prompt is capped at PROMPT_TOKEN_BUDGET, so the size rule catches
+# map-reduce reads of whole documents, not every question on a long filing.
+# While the heavy model's recent p95 latency is over the limit, everything
+# goes to the fast model instead; old samples age out, so the heavy model is
+# tried again once they do. Every decision is printed and appended to
+# ROUTING_LOG for review.
+
+ROUTE_HEAVY_MIN_PROMPT_TOKENS = 30_000
+ROUTE_HEAVY_P95_LIMIT = 30.0      # seconds
+ROUTE_MIN_SAMPLES = 10            # latency samples needed before the p95 is trusted
+ROUTE_LATENCY_MAX_AGE = 10 * 60   # seconds a latency sample counts for
+ROUTING_LOG = os.path.join(CACHE_DIR, "routing.jsonl")
+ROUTING_LOG_MAX_BYTES = 16 * 1024 * 1024   # then it is rotated to routing.jsonl.1, replacing the previous one
+
+_ANALYSIS_QUESTION = re.compile(
+    r"\b(why|how (?:does|did|do|will|would|could|should|can)|compare[sd]?|comparison|versus|vs|"
+    r"analy[sz]e|analysis|assess|evaluate|explain|implications?|impact|outlook|forecast|"
+    r"risks?|trends?|drivers?|pros and cons|strengths?|weakness(?:es)?|recommend\w*)\b",
+    re.IGNORECASE
+)
+
+
+def classify_question(question):
+    return "analysis" if _ANALYSIS_QUESTION.search(question) else "lookup"
+
+
+class ModelRouter:
+    def __init__(self, fast_model, heavy_model, heavy_min_prompt_tokens=ROUTE_HEAVY_MIN_PROMPT_TOKENS,
+                 heavy_p95_limit=ROUTE_HEAVY_P95_LIMIT, min_samples=ROUTE_MIN_SAMPLES, log_path=ROUTING_LOG,
+                 log_max_bytes=ROUTING_LOG_MAX_BYTES):
+        self.fast_model = fast_model     # model names
+        self.heavy_model = heavy_model
+        self.heavy_min_prompt_tokens = heavy_min_prompt_tokens
+        self.heavy_p95_limit = heavy_p95_limit
+        self.min_samples = min_samples
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self.latencies = {fast_model: deque(maxlen=1000), heavy_model: deque(maxlen=1000)}   # (when, seconds)
+        self.decisions = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def record(self, model_name, latency):
+        with self._lock:
+            self.latencies.setdefault(model_name, deque(maxlen=1000)).append((time.monotonic(), latency))
+
+    def _recent(self, model_name):
+        cutoff = time.monotonic() - ROUTE_LATENCY_MAX_AGE
+        with self._lock:
+            return sorted(latency for when, latency in self.latencies.get(model_name, ()) if when >= cutoff)
+
+    def route(self, question, prompt_tokens, deep=False):
+        """Returns (model_name, reason) and logs the decision."""
+        question_type = classify_question(question)
+        if deep:
+            reason = "deep analysis requested"
+        elif prompt_tokens >= self.heavy_min_prompt_tokens:
+            reason = f"large prompt (~{prompt_tokens:,} tokens)"
+        elif question_type == "analysis":
+            reason = "analysis question"
+        else:
+            reason = None
+        model_name = self.heavy_model if reason else self.fast_model
+        reason = reason or "lookup question, small prompt"
+
+        if model_name == self.heavy_model and self.heavy_model != self.fast_model:
+            recent = self._recent(self.heavy_model)
+            p95 = percentile(recent, 95)
+            if len(recent) >= self.min_samples and p95 > self.heavy_p95_limit:
+                model_name = self.fast_model
+                reason += f"; {self.heavy_model} p95 {p95:.1f}s is over {self.heavy_p95_limit:.0f}s, using {self.fast_model}"
+
+        self._log({
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "question": question[:200],
+            "question_type": question_type,
+            "prompt_tokens": prompt_tokens,
+            "deep": deep,
+            "model": model_name,
+            "reason": reason,
+        })
+        return model_name, reason
+
+    def _log(self, decision):
+        print(f"Routing: {decision['model']} ({decision['reason']})")
+        with self._lock:
+            self.decisions.append(decision)
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                    os.replace(self.log_path, self.log_path + ".1")
+                with open(self.log_path, "a", encoding="utf-8") as log:
+                    log.write(json.dumps(decision) + "\n")
+            except OSError as e:
+                print(f"Couldn't write the routing log: {e}")
+
+    def stats(self):
+        """Per model: requests routed to it and p50/p95 latency over the recent window."""
+        with self._lock:
+            decisions = list(self.decisions)
+            names = list(self.latencies)
+        stats = {}
+        for name in names:
+            recent = self._recent(name)
+            stats[name] = {
+                "routed": sum(1 for d in decisions if d["model"] == name),
+                "samples": len(recent),
+                "p50": percentile(recent, 50),
+                "p95": percentile(recent, 95),
+            }
+        return stats
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router(fast_model, heavy_model):
+    # One per process, so latency history is shared by every session
+    global _router
+    with _router_lock:
+        if _router is None or (_router.fast_model, _router.heavy_model) != (fast_model, heavy_model):
+            _router = ModelRouter(fast_model, heavy_model)
+        return _router
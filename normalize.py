@@ -0,0 +1,178 @@
+import re
+from collections import Counter
+
+
+# ------------------ TEXT NORMALIZATION ------------------
+# Extracted text is cleaned by a chain of generator stages before it is stored
+# and sent with every prompt. Each stage takes an iterator of lines and yields
+# lines, so stages can be added, dropped or reordered freely. Pages are
+# separated by PAGE_BREAK lines (extract_pdf joins pages with "\f").
+
+PAGE_BREAK = "\f"
+HEADER_FOOTER_LINES = 2      # lines at the top/bottom of a page that may be a header/footer
+HEADER_FOOTER_MIN_PAGES = 3
+HEADER_FOOTER_RATIO = 0.5    # must repeat on at least this share of pages
+DUPLICATE_MIN_CHARS = 40     # shorter lines ("Total", "2024") legitimately repeat
+
+# Page-number-like tokens: a line that is just "3", "- 3 -", "Page 3" or
+# "3 of 400" / "3/400", or such a number at the start or end of a running
+# header, set off by "|", a dash or a bullet, or by the word "Page"
+_PAGE_NO = r"(?:page\s+)?\d+(?:\s*(?:of|/)\s*\d+)?"
+_PAGE_NUMBER = re.compile(
+    rf"^[-\u2013\s]*{_PAGE_NO}[-\u2013\s]*$"
+    rf"|(?<=[|\u2013\u2022\u00b7-])\s*{_PAGE_NO}\s*$"
+    rf"|\bpage\s+\d+(?:\s*(?:of|/)\s*\d+)?\s*$"
+    rf"|^\s*{_PAGE_NO}\s*(?=[|\u2013\u2022\u00b7-])",
+    re.IGNORECASE,
+)
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_HYPHEN_END = re.compile(r"[A-Za-z]-$")
+_SOURCE_MARKER = re.compile(r"^--- (?:Article \d+ from|Document \d+:) (.+?) ---$")
+
+
+def iter_lines(text):
+    for i, page in enumerate(text.split(PAGE_BREAK)):
+        if i:
+            yield PAGE_BREAK
+        yield from page.split("\n")
+
+
+def _pages(lines):
+    page = []
+    for line in lines:
+        if line == PAGE_BREAK:
+            yield page
+            page = []
+        else:
+            page.append(line)
+    yield page
+
+
+def _edge_key(line):
+    # Only page numbers are masked, so "Page 3 of 400" matches "Page 4 of 400"
+    # while a template line with figures ("Operating margin was 12%.") has to
+    # repeat word for word, figures included, to count as a header/footer
+    return _PAGE_NUMBER.sub("#", line)
+
+
+def strip_headers_footers(lines):
+    # Needs every page before it can tell what repeats, so this stage buffers
+    pages = list(_pages(lines))
+    if len(pages) < HEADER_FOOTER_MIN_PAGES:
+        for i, page in enumerate(pages):
+            if i:
+                yield PAGE_BREAK
+            yield from page
+        return
+
+    def edges(page):
+        content = [line.strip() for line in page if line.strip()]
+        return set(content[:HEADER_FOOTER_LINES] + content[-HEADER_FOOTER_LINES:])
+
+    counts = Counter(_edge_key(line) for page in pages for line in edges(page))
+    threshold = max(HEADER_FOOTER_MIN_PAGES, len(pages) * HEADER_FOOTER_RATIO)
+    repeated = {line for line, count in counts.items() if count >= threshold}
+
+    for i, page in enumerate(pages):
+        if i:
+            yield PAGE_BREAK
+        page_edges = edges(page)
+        for line in page:
+            stripped = line.strip()
+            if stripped in page_edges and _edge_key(stripped) in repeated:
+                continue
+            yield line
+
+
+def dehyphenate(lines):
+    # "reve-" + "nue grew" -> "revenue grew"
+    held = None
+    for line in lines:
+        if held is not None:
+            if line[:1].islower():
+                line = held[:-1] + line
+            else:
+                yield held
+            held = None
+        if _HYPHEN_END.search(line.rstrip()):
+            held = line.rstrip()
+            continue
+        yield line
+    if held is not None:
+        yield held
+
+
+def collapse_whitespace(lines):
+    # Runs of spaces/tabs (and non-breaking spaces) become one space
+    for line in lines:
+        yield line if line == PAGE_BREAK else _SPACES.sub(" ", line).strip()
+
+
+def drop_duplicate_lines(lines):
+    seen = set()
+    for line in lines:
+        if len(line) >= DUPLICATE_MIN_CHARS:
+            if line in seen:
+                continue
+            seen.add(line)
+        yield line
+
+
+def compact_source_markers(lines):
+    # "--- Article 3 from https://... ---" -> "[Source: https://...]"
+    for line in lines:
+        match = _SOURCE_MARKER.match(line.strip())
+        yield f"[Source: {match.group(1)}]" if match else line
+
+
+def squeeze_blank_lines(lines):
+    # Runs of blank lines (including the ones left behind by earlier stages) become one
+    blank = False
+    for line in lines:
+        if line == PAGE_BREAK:
+            yield line
+            continue
+        if not line:
+            if blank:
+                continue
+            blank = True
+        else:
+            blank = False
+        yield line
+
+
+DEFAULT_STAGES = [
+    strip_headers_footers,
+    dehyphenate,
+    collapse_whitespace,
+    drop_duplicate_lines,
+    compact_source_markers,
+    squeeze_blank_lines,
+]
+
+
+def _metered(lines, totals, name):
+    # Counts what flows out of a stage without materializing it
+    for line in lines:
+        totals[name] = totals.get(name, 0) + len(line) + 1
+        yield line
+
+
+def normalize_text(text, stages=DEFAULT_STAGES):
+    """
+    Runs text through the stages and returns (clean_text, report), where
+    report is a list of (stage_name, chars_removed) in pipeline order.
+    """
+    totals = {}
+    lines = _metered(iter_lines(text), totals, "input")
+    names = ["input"]
+    for stage in stages:
+        lines = _metered(stage(lines), totals, stage.__name__)
+        names.append(stage.__name__)
+
+    clean = "\n".join(line for line in lines if line != PAGE_BREAK).strip()
+
+    report = []
+    for previous, name in zip(names, names[1:]):
+        report.append((name, totals.get(previous, 0) - totals.get(name, 0)))
+    return clean, report
@@ -0,0 +1,276 @@
+import math
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from cache import CACHE_DIR
+
+
+# ------------------ CHUNKING ------------------
+# Content is cut into overlapping chunks once, when it is loaded. Chunks end on
+# sentence boundaries and the last sentence(s) of a chunk are repeated at the
+# start of the next so an answer split across a boundary is still found.
+
+CHUNK_CHARS = 1500
+CHUNK_OVERLAP_CHARS = 200
+RETRIEVAL_TOP_K = 8
+CONTEXT_TOKEN_BUDGET = 6000   # tokens of content per prompt, roughly 4 chars each
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_WORD = re.compile(r"\w+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from",
+    "has", "have", "how", "in", "is", "it", "its", "of", "on", "or", "that", "the",
+    "this", "to", "was", "were", "what", "when", "where", "which", "who", "why", "with",
+}
+
+
+def approx_tokens(text):
+    return len(text) // 4
+
+
+def split_sentences(text):
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # Text that runs on without punctuation (tables, lists) is cut hard
+        while len(sentence) > CHUNK_CHARS:
+            yield sentence[:CHUNK_CHARS]
+            sentence = sentence[CHUNK_CHARS:]
+        yield sentence
+
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    chunks = []
+    current = []
+    size = 0
+    for sentence in split_sentences(text):
+        if current and size + len(sentence) > chunk_chars:
+            chunks.append(" ".join(current))
+            # Carry the tail sentences over as overlap
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 1
+            current = overlap
+            size = overlap_size
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def tokenize(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+# ------------------ BM25 ------------------
+
+class BM25Index:
+    """
+    In-memory inverted index over the chunks. Only the postings of the query
+    terms are touched at search time, so a question costs the same on a
+    10-page or a 900-page document.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)   # term -> [(chunk_id, term_frequency)]
+        self.lengths = []
+        for chunk_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((chunk_id, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / (self.avg_length or 1))
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def build_index(text):
+    return BM25Index(chunk_text(text))
+
+
+def select_context(chunks, ranked, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Takes (chunk_id, score) pairs best first and keeps as many chunks as fit
+    in the budget. They are returned in document order so the model reads
+    them the way they appear in the source.
+    """
+    picked = []
+    used = 0
+    for chunk_id, _ in ranked:
+        cost = approx_tokens(chunks[chunk_id])
+        if used + cost > token_budget:
+            continue
+        picked.append(chunk_id)
+        used += cost
+    return "\n...\n".join(chunks[chunk_id] for chunk_id in sorted(picked))
+
+
+# ------------------ DENSE VECTORS ------------------
+# Hashed TF-IDF vectors, no model download, no GPU. Every chunk is a row of one
+# contiguous float32 matrix, so a query is a single matrix-vector product plus
+# an argpartition for the top k. The matrix is saved per content hash, so
+# reloading the same document doesn't re-embed it. Like the SQLite caches the
+# files are capped: least recently used go first once they pass VECTOR_MAX_BYTES.
+
+VECTOR_DIM = 1024
+VECTOR_VERSION = 1
+VECTOR_DIR = os.path.join(CACHE_DIR, "vectors")
+VECTOR_MAX_BYTES = 512 * 1024 * 1024
+RRF_K = 60   # reciprocal rank fusion constant
+
+
+def _hashed_counts(text, bigrams=True):
+    # crc32 rather than hash(): it has to be the same in every process and run
+    counts = defaultdict(float)
+    terms = tokenize(text)
+    if bigrams:
+        terms = terms + [a + " " + b for a, b in zip(terms, terms[1:])]
+    for term in terms:
+        h = zlib.crc32(term.encode("utf-8"))
+        counts[h % VECTOR_DIM] += 1.0 if h & 0x80000000 else -1.0
+    return counts
+
+
+def embed_text(text, bigrams=True):
+    # Plain L2-normalized hashed term vector, no idf; for short texts like questions
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for col, value in _hashed_counts(text, bigrams).items():
+        vector[col] = value
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    def __init__(self, matrix, idf):
+        self.matrix = matrix   # (chunks, VECTOR_DIM) float32, rows L2-normalized
+        self.idf = idf         # (VECTOR_DIM,) float32
+
+    @classmethod
+    def build(cls, chunks):
+        tf = np.zeros((len(chunks), VECTOR_DIM), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            for col, value in _hashed_counts(chunk).items():
+                tf[row, col] = value
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log((1 + len(chunks)) / (1 + df)).astype(np.float32) + 1
+        # Sublinear tf keeps one very repetitive chunk from dominating
+        matrix = np.sign(tf) * np.log1p(np.abs(tf)) * idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return cls(np.ascontiguousarray(matrix, dtype=np.float32), idf)
+
+    def embed_query(self, query):
+        vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+        for col, value in _hashed_counts(query).items():
+            vector[col] = value
+        vector = np.sign(vector) * np.log1p(np.abs(vector)) * self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        if not len(self.matrix):
+            return []
+        scores = self.matrix @ self.embed_query(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f".{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, matrix=self.matrix, idf=self.idf)
+        os.replace(tmp_path, path)   # atomic, other processes never see half a file
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["matrix"], data["idf"])
+
+
+def evict_vectors(vector_dir=None, max_bytes=None, keep=None):
+    """Deletes the least recently used vector files until the rest fit in max_bytes."""
+    vector_dir = vector_dir or VECTOR_DIR
+    max_bytes = VECTOR_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    try:
+        for entry in os.scandir(vector_dir):
+            if entry.name.endswith(".npz") and entry.path != keep:
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in files)
+    if keep is not None and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue   # another process got there first
+        total -= size
+
+
+def load_or_build_vectors(content_hash, chunks):
+    path = os.path.join(VECTOR_DIR, f"{content_hash}.v{VECTOR_VERSION}.d{VECTOR_DIM}.npz")
+    if os.path.exists(path):
+        try:
+            vectors = VectorIndex.load(path)
+            if len(vectors.matrix) == len(chunks):
+                os.utime(path)   # the mtime is what eviction goes by
+                return vectors
+        except (OSError, ValueError, KeyError):
+            pass
+    vectors = VectorIndex.build(chunks)
+    vectors.save(path)
+    evict_vectors(keep=path)
+    return vectors
+
+
+def fuse_rankings(*rankings, k=RETRIEVAL_TOP_K):
+    # Reciprocal rank fusion: BM25 and cosine scores aren't comparable, ranks are
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking):
+            scores[chunk_id] += 1.0 / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def retrieve_context(index, question, k=RETRIEVAL_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET, vectors=None):
+    ranked = index.search(question, k)
+    if vectors is not None:
+        ranked = fuse_rankings(ranked, vectors.search(question, k), k=k)
+    # Nothing matched at all: fall back to the start of the document
+    ranked = ranked or [(i, 0.0) for i in range(len(index.chunks))]
+    return select_context(index.chunks, ranked, token_budget)
@@ -0,0 +1,113 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+from extractors import filter_frame, iter_docx_blocks, load_csv_frame, read_question_list
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        "ticker": pd.Series(["ABC", "XYZ", "ABC"], dtype="category"),
+        "price": [120.0, 80.0, 101.5],
+        "listed": [True, False, True],
+    })
+
+
+def test_filter_numeric(frame):
+    assert list(filter_frame(frame, "price", ">", "100")["price"]) == [120.0, 101.5]
+
+
+def test_filter_text_and_categorical(frame):
+    assert len(filter_frame(frame, "ticker", "==", "ABC")) == 2
+    assert len(filter_frame(frame, "ticker", "contains", "y")) == 1
+
+
+def test_filter_bool(frame):
+    assert len(filter_frame(frame, "listed", "==", "false")) == 1
+
+
+def test_filter_value_is_never_evaluated(frame, tmp_path):
+    marker = tmp_path / "pwned"
+    value = f'@os.system("touch {marker}") == 0'
+    assert filter_frame(frame, "ticker", "==", value).empty
+    with pytest.raises(ValueError):
+        filter_frame(frame, "price", "==", value)
+    assert not marker.exists()
+
+
+def test_filter_rejects_unknown_operator_and_column(frame):
+    with pytest.raises(ValueError):
+        filter_frame(frame, "price", "__import__", "1")
+    with pytest.raises(ValueError):
+        filter_frame(frame, "nope", "==", "1")
+
+
+def test_repeated_text_columns_become_categoricals(tmp_path):
+    path = tmp_path / "prices.csv"
+    rows = [f"{'ABC' if i % 2 else 'XYZ'},{i * 1.5},note {i}" for i in range(100)]
+    path.write_text("ticker,price,note\n" + "\n".join(rows) + "\n")
+    frame = load_csv_frame(str(path), chunksize=30)
+    assert isinstance(frame["ticker"].dtype, pd.CategoricalDtype)
+    assert set(frame["ticker"].cat.categories) == {"ABC", "XYZ"}
+    assert not isinstance(frame["note"].dtype, pd.CategoricalDtype)
+    assert frame["price"].dtype == "float32"
+
+
+def test_question_list_csv_without_header_keeps_first_question():
+    data = io.BytesIO(b"What was revenue in 2023?\nWhat is the dividend policy?\n")
+    assert read_question_list(data, csv=True) == ["What was revenue in 2023?", "What is the dividend policy?"]
+
+
+def test_question_list_csv_drops_header_row():
+    data = io.BytesIO(b"Question,Owner\nWhat was revenue?,ana\n\nWho audits the accounts?,ben\n")
+    assert read_question_list(data, csv=True) == ["What was revenue?", "Who audits the accounts?"]
+
+
+def test_question_list_text_rereads_from_start():
+    data = io.BytesIO(b"first?\n\n second? \n")
+    assert read_question_list(data) == ["first?", "second?"]
+    assert read_question_list(data) == ["first?", "second?"]
+
+
+def make_docx(body_xml):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr(
+            "word/document.xml",
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body_xml}</w:body></w:document>",
+        )
+    data.seek(0)
+    return data
+
+
+def test_docx_tab_stops_are_not_text():
+    doc = make_docx(
+        '<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/><w:tab w:val="right" w:pos="9000"/></w:tabs></w:pPr>'
+        "<w:r><w:t>Revenue</w:t></w:r><w:r><w:tab/><w:t>1,204</w:t></w:r><w:r><w:br/><w:t>net</w:t></w:r></w:p>"
+    )
+    assert list(iter_docx_blocks(doc)) == ["Revenue\t1,204\nnet"]
+
+
+def test_docx_tables_come_out_as_rows():
+    cell = "<w:tc><w:p><w:r><w:t>{}</w:t></w:r></w:p></w:tc>"
+    doc = make_docx(
+        "<w:p><w:r><w:t>Results</w:t></w:r></w:p>"
+        f"<w:tbl><w:tr>{cell.format('Year')}{cell.format('Sales')}</w:tr>"
+        f"<w:tr>{cell.format('2024')}{cell.format('9.1')}</w:tr></w:tbl>"
+    )
+    assert list(iter_docx_blocks(doc)) == ["Results", "Year | Sales", "2024 | 9.1"]
+
+
+def test_docx_nested_table_is_flattened_into_its_cell():
+    cell = "<w:tc><w:p><w:r><w:t>{}</w:t></w:r></w:p></w:tc>"
+    inner = f"<w:tbl><w:tr>{cell.format('i1')}{cell.format('i2')}</w:tr></w:tbl>"
+    doc = make_docx(
+        f"<w:tbl><w:tr>{cell.format('A')}"
+        f"<w:tc><w:p><w:r><w:t>B-before</w:t></w:r></w:p>{inner}</w:tc>"
+        f"{cell.format('C')}</w:tr></w:tbl>"
+    )
+    assert list(iter_docx_blocks(doc)) == ["A | B-before i1 / i2 | C"]
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from jobs import JobExecutor
+from llm import FairScheduler, SingleFlight
+
+
+def wait_for(job, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline, f"{job.id} still {job.status}"
+        time.sleep(0.01)
+
+
+def blocker(executor):
+    release = threading.Event()
+    job_id = executor.submit(lambda job: release.wait(5))
+    return job_id, release
+
+
+def test_cancel_while_queued_never_runs_the_job():
+    executor = JobExecutor(max_workers=1)
+    _, release = blocker(executor)
+    ran = []
+    queued = executor.submit(lambda job: ran.append(job.id))
+    executor.cancel(queued)
+    assert executor.get(queued).status == "cancelled"
+    release.set()
+    time.sleep(0.1)
+    assert ran == []
+
+
+def test_queue_position_and_wait_metrics():
+    executor = JobExecutor(max_workers=1)
+    _, release = blocker(executor)
+    first = executor.submit(lambda job: "first")
+    second = executor.submit(lambda job: "second")
+    assert (executor.queue_position(first), executor.queue_position(second)) == (1, 2)
+    assert executor.stats()["queued"] == 2
+    time.sleep(0.2)
+    release.set()
+    wait_for(executor.get(second))
+    assert executor.get(second).result == "second"
+    assert executor.queue_position(second) == 0
+    stats = executor.stats()
+    assert stats["queued"] == 0
+    assert stats["wait_p95"] >= 0.2 and stats["wait_avg"] > 0
+
+
+def test_cancel_reaches_a_job_waiting_in_the_scheduler():
+    scheduler = FairScheduler(max_concurrent=1)
+    held = scheduler.acquire("someone-else")
+    executor = JobExecutor(max_workers=2)
+    job_id = executor.submit(lambda job: scheduler.acquire("alice", check_cancelled=job.check_cancelled))
+    time.sleep(0.1)
+    assert executor.get(job_id).status == "running"
+    start = time.monotonic()
+    executor.cancel(job_id)
+    wait_for(executor.get(job_id))
+    assert executor.get(job_id).status == "cancelled"
+    assert time.monotonic() - start < 1.0
+    # The cancelled call left the queue; the next one gets the slot
+    scheduler.release(held)
+    scheduler.release(scheduler.acquire("bob"))
+    assert scheduler.stats()["alice"]["queued"] == 0
+
+
+def test_cancel_reaches_a_job_waiting_on_another_request():
+    flights = SingleFlight()
+    release = threading.Event()
+    executor = JobExecutor(max_workers=2)
+    leader = executor.submit(lambda job: flights.do("key", lambda flight: release.wait(5) and "answer"))
+    time.sleep(0.05)
+    waiter = executor.submit(
+        lambda job: flights.do("key", lambda flight: "own call", check_cancelled=job.check_cancelled)
+    )
+    time.sleep(0.1)
+    executor.cancel(waiter)
+    wait_for(executor.get(waiter))
+    assert executor.get(waiter).status == "cancelled"
+    # The leading request carries on for whoever else is waiting
+    assert executor.get(leader).status == "running"
+    release.set()
+    wait_for(executor.get(leader))
+    assert executor.get(leader).result[0] == "answer"
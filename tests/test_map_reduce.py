@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from llm import FakeModel, TokenBucket, UsageTotals, map_reduce_answer
+from retrieval import approx_tokens
+
+
+class Cancelled(Exception):
+    pass
+
+
+def test_cancel_stops_the_fan_out():
+    calls = []
+    lock = threading.Lock()
+
+    def slow_generate(prompt):
+        with lock:
+            calls.append(prompt)
+        time.sleep(0.2)
+        return "note"
+
+    def cancel_after_first(done, total):
+        raise Cancelled()
+
+    chunks = [f"chunk {i} " * 3000 for i in range(40)]   # one map call per chunk
+    start = time.perf_counter()
+    with pytest.raises(Cancelled):
+        map_reduce_answer(slow_generate, chunks, "What was revenue?", max_concurrency=4,
+                          limiter=TokenBucket(1000, 1000), on_progress=cancel_after_first)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 1.0
+    time.sleep(0.5)   # let the calls already in flight finish
+    assert len(calls) <= 8
+
+
+def test_all_parts_are_read_and_combined():
+    def generate(prompt):
+        return "combined" if "Notes:" in prompt else "note"
+
+    progress = []
+    stats = {}
+    answer = map_reduce_answer(generate, [f"chunk {i} " * 3000 for i in range(6)], "What was revenue?",
+                               limiter=TokenBucket(1000, 1000),
+                               on_progress=lambda done, total: progress.append(done), stats=stats)
+    assert answer == "combined"
+    assert progress == list(range(1, stats["map_calls"] + 1))
+
+
+def test_usage_is_summed_over_map_and_reduce_calls():
+    model = FakeModel(chunk_delay=0.0)
+    usage = UsageTotals()
+
+    def generate(prompt):
+        response = model.generate_content(prompt)
+        usage.add(response, prompt)
+        return response.text
+
+    chunks = [f"chunk {i} " * 3000 for i in range(3)]
+    stats = {}
+    map_reduce_answer(generate, chunks, "What was revenue?", limiter=TokenBucket(1000, 1000), stats=stats)
+    input_tokens, output_tokens, estimated = usage.totals()
+    assert estimated
+    assert input_tokens > sum(approx_tokens(chunk) for chunk in chunks)
+    assert output_tokens > 0
+
+
+def test_parallel_map_calls_beat_reading_the_parts_one_by_one():
+    # Deterministic model, ~0.2s per call whatever the prompt
+    model = FakeModel(chunk_delay=0.2, words_per_chunk=100)
+
+    def generate(prompt):
+        return model.generate_content(prompt).text
+
+    chunks = [f"chunk {i} " * 3000 for i in range(8)]
+    stats = {}
+    start = time.perf_counter()
+    answer = map_reduce_answer(generate, chunks, "What was revenue?", max_concurrency=4,
+                               limiter=TokenBucket(1000, 1000), stats=stats)
+    elapsed = time.perf_counter() - start
+
+    assert answer == "This is a fake answer to: What was revenue?"
+    assert stats["map_calls"] == 8
+    assert stats["map_sequential_seconds"] >= 8 * 0.2
+    assert stats["map_seconds"] < stats["map_sequential_seconds"] / 2.5
+    # The reduce call comes on top of the map calls
+    assert elapsed < stats["map_sequential_seconds"]
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from llm import ConversationMemory, is_follow_up
+
+
+@pytest.mark.parametrize("question", [
+    "And for the previous year?",
+    "What about Europe?",
+    "How did it change?",
+    "Why did they cut the dividend?",
+])
+def test_follow_ups(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "What was FY24 revenue?",
+    "List the main risk factors",
+    "Who is the CFO of Acme Corp?",
+])
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
+
+
+def test_turns_past_the_window_are_folded():
+    memory = ConversationMemory(keep_turns=2)
+    for i in range(4):
+        memory.add_turn(f"q{i}", f"a{i}")
+    assert memory.needs_fold
+    memory.fold(summarize=lambda prompt: "summary")
+    assert [q for q, _ in memory.turns] == ["q2", "q3"]
+    assert memory.summary == "summary" and memory.folded_turns == 2
+
+
+def test_fold_does_not_block_readers():
+    memory = ConversationMemory(keep_turns=1)
+    memory.add_turn("q0", "a0")
+    memory.add_turn("q1", "a1")
+    summarizing = threading.Event()
+    release = threading.Event()
+
+    def slow_summary(prompt):
+        summarizing.set()
+        release.wait(5)
+        return "summary"
+
+    folding = threading.Thread(target=memory.fold, args=(slow_summary,))
+    folding.start()
+    assert summarizing.wait(5)
+    # The model call is in progress: render and add_turn still go through, and
+    # the turn being folded is still there verbatim
+    memory.add_turn("q2", "a2")
+    assert "q0" in memory.render()
+    release.set()
+    folding.join(5)
+    assert [q for q, _ in memory.turns] == ["q2"]
+    assert memory.folded_turns == 2
+
+
+def test_clear_during_fold_wins():
+    memory = ConversationMemory(keep_turns=0)
+    memory.add_turn("q0", "a0")
+
+    def summarize(prompt):
+        memory.clear()
+        return "stale summary"
+
+    memory.fold(summarize)
+    assert memory.summary == "" and not memory.turns
@@ -0,0 +1,34 @@
+import pytest
+
+from normalize import PAGE_BREAK, normalize_text, strip_headers_footers, iter_lines
+
+
+def strip(pages):
+    out = [[]]
+    for line in strip_headers_footers(iter_lines(PAGE_BREAK.join(pages))):
+        if line == PAGE_BREAK:
+            out.append([])
+        else:
+            out[-1].append(line)
+    return ["\n".join(page) for page in out]
+
+
+@pytest.mark.parametrize("footer", ["Page {n} of 6", "{n}", "- {n} -", "Acme plc Annual Report 2024 | {n}", "{n}/6"])
+def test_page_numbered_headers_and_footers_are_removed(footer):
+    pages = [f"Acme plc\nBody text of page {n}.\nMore on page {n}.\n{footer.format(n=n)}" for n in range(1, 7)]
+    for n, page in enumerate(strip(pages), start=1):
+        assert page == f"Body text of page {n}.\nMore on page {n}."
+
+
+def test_repeated_template_lines_keep_their_figures():
+    pages = [f"Segment review\nRevenue grew.\nCosts were flat.\nOperating margin was {10 + n}%." for n in range(6)]
+    clean, _ = normalize_text(PAGE_BREAK.join(pages))
+    for n in range(6):
+        assert f"Operating margin was {10 + n}%." in clean
+    # The header really is the same on every page, so it still goes
+    assert "Segment review" not in clean
+
+
+def test_short_documents_are_left_alone():
+    pages = ["Header\nbody one", "Header\nbody two"]
+    assert strip(pages) == pages
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import llm
+from llm import CircuitBreaker, CircuitOpenError, FakeModel, FaultyModel, ProviderGuard, ResilientModel
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_BACKOFF_BASE", 0.0)
+
+
+@pytest.fixture
+def guard():
+    guard = ProviderGuard()
+    guard.breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.2)
+    return guard
+
+
+def fake():
+    return FakeModel(chunk_delay=0.0)
+
+
+def test_retries_then_succeeds():
+    guard = ProviderGuard()
+    faulty = FaultyModel(fake(), failure_rate=0.0, fail_first=2)
+    answer = ResilientModel(faulty, guard, max_attempts=4).generate_content("Question: revenue?").text
+    assert answer == "This is a fake answer to: revenue?"
+    assert faulty.calls == 3
+    stats = guard.metrics.stats()
+    assert stats["errors"] == 2 and stats["retries"] == 2
+
+
+def test_non_retryable_error_passes_straight_through(guard):
+    faulty = FaultyModel(fake(), failure_rate=1.0, errors=(google_exceptions.InvalidArgument,))
+    with pytest.raises(google_exceptions.InvalidArgument):
+        ResilientModel(faulty, guard, max_attempts=4).generate_content("Question: revenue?")
+    assert faulty.calls == 1
+    assert guard.breaker.state == "closed"
+
+
+def test_breaker_opens_goes_half_open_and_closes(guard):
+    failing = ResilientModel(FaultyModel(fake(), failure_rate=0.0, fail_first=2), guard, max_attempts=1)
+    for _ in range(2):
+        with pytest.raises(google_exceptions.GoogleAPICallError):
+            failing.generate_content("Question: revenue?")
+    assert guard.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        failing.generate_content("Question: revenue?")
+    assert guard.metrics.stats()["rejected"] == 1
+
+    time.sleep(0.25)
+    assert guard.breaker.state == "half-open"
+    # The third call goes through as the trial and succeeds
+    assert failing.generate_content("Question: revenue?").text.endswith("revenue?")
+    assert guard.breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_call_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()   # the trial is still out
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+class BrokenStream:
+    def __init__(self, chunk_delay=0.0):
+        self.chunk_delay = chunk_delay
+
+    def generate_content(self, prompt, stream=False):
+        def chunks():
+            yield llm.FakeResponse("Revenue ")
+            time.sleep(self.chunk_delay)
+            raise google_exceptions.ServiceUnavailable("dropped mid-stream")
+        return chunks()
+
+
+def test_mid_stream_error_is_recorded_as_a_failure(guard):
+    stream = ResilientModel(BrokenStream(), guard).generate_content("Question: revenue?", stream=True)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        list(stream)
+    stats = guard.metrics.stats()
+    assert stats["attempts"] == 1 and stats["errors"] == 1
+    assert guard.breaker.failures == 1
+
+
+def test_streamed_latency_covers_the_whole_stream(guard):
+    model = FakeModel(chunk_delay=0.05, words_per_chunk=1)   # 6 words, ~0.3s
+    text = "".join(c.text for c in ResilientModel(model, guard).generate_content("Question: revenue?", stream=True))
+    assert text.strip() == "This is a fake answer to: revenue?"
+    assert guard.metrics.stats()["p50"] >= 0.25
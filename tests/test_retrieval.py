@@ -0,0 +1,22 @@
+import os
+import time
+
+import retrieval
+from retrieval import chunk_text, load_or_build_vectors
+
+
+def test_vector_files_are_evicted_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "VECTOR_DIR", str(tmp_path))
+    chunks = chunk_text("Revenue grew in every segment. " * 200)
+    load_or_build_vectors("first", chunks)
+    size = next(tmp_path.iterdir()).stat().st_size
+    monkeypatch.setattr(retrieval, "VECTOR_MAX_BYTES", size * 2 + size // 2)
+
+    load_or_build_vectors("second", chunks)
+    time.sleep(0.01)
+    load_or_build_vectors("first", chunks)   # used again, so "second" is now the oldest
+    time.sleep(0.01)
+    load_or_build_vectors("third", chunks)
+
+    names = sorted(name.split(".")[0] for name in os.listdir(tmp_path))
+    assert names == ["first", "third"]
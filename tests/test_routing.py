@@ -0,0 +1,64 @@
+from llm import FakeContextCaches, ModelContexts, ModelRouter, PROMPT_TOKEN_BUDGET, sent_prompt_tokens
+
+
+def make_router(tmp_path, **kwargs):
+    return ModelRouter("fast", "heavy", log_path=str(tmp_path / "routing.jsonl"), **kwargs)
+
+
+def test_lookup_on_a_long_filing_stays_on_the_fast_model(tmp_path):
+    router = make_router(tmp_path)
+    tokens = sent_prompt_tokens(200_000, "FY24 revenue?")
+    assert tokens <= PROMPT_TOKEN_BUDGET
+    assert router.route("FY24 revenue?", tokens)[0] == "fast"
+
+
+def test_map_reduce_over_a_long_filing_goes_heavy(tmp_path):
+    router = make_router(tmp_path)
+    tokens = sent_prompt_tokens(200_000, "FY24 revenue?", map_reduce=True)
+    assert router.route("FY24 revenue?", tokens)[0] == "heavy"
+
+
+def test_analysis_and_deep_go_heavy(tmp_path):
+    router = make_router(tmp_path)
+    assert router.route("Why did margins fall?", 500)[0] == "heavy"
+    assert router.route("FY24 revenue?", 500, deep=True)[0] == "heavy"
+
+
+def test_slow_heavy_model_falls_back(tmp_path):
+    router = make_router(tmp_path, min_samples=3, heavy_p95_limit=5)
+    for _ in range(3):
+        router.record("heavy", 9.0)
+    model_name, reason = router.route("Why did margins fall?", 500)
+    assert model_name == "fast"
+    assert "p95" in reason
+
+
+def test_each_model_gets_its_own_context_cache():
+    backends = {"fast": FakeContextCaches("fast"), "heavy": FakeContextCaches("heavy")}
+    contexts = ModelContexts(backends, "document " * 5000)
+    assert contexts.get("fast").model().model_name == "fast"
+    assert contexts.get("heavy").model().model_name == "heavy"
+    assert contexts.get("heavy") is contexts.get("heavy")
+    assert len(backends["heavy"].handles) == 1
+    contexts.close()
+    assert not backends["fast"].handles and not backends["heavy"].handles
+
+
+def test_failed_cached_call_is_not_retried_on_later_questions():
+    backend = FakeContextCaches("fast")
+    context = ModelContexts({"fast": backend}, "document " * 5000).get("fast")
+    assert context.model() is not None
+    context.discard(LookupError("cachedContents/fake-1 has expired"))
+    assert not context.active
+    assert context.model() is None
+    assert not backend.handles
+
+
+def test_routing_log_is_rotated(tmp_path):
+    router = make_router(tmp_path, log_max_bytes=2000)
+    for _ in range(100):
+        router.route("FY24 revenue?", 500)
+    log = tmp_path / "routing.jsonl"
+    assert log.stat().st_size < 2000 + 500
+    assert (tmp_path / "routing.jsonl.1").exists()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["routing.jsonl", "routing.jsonl.1"]
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from llm import BULK, INTERACTIVE, FairScheduler, parse_user_weights
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queued(scheduler):
+    return sum(row["queued"] for row in scheduler.stats().values())
+
+
+def run_calls(scheduler, calls):
+    """Starts a thread per (user, priority, tokens); each records its turn and releases at once."""
+    order = []
+    lock = threading.Lock()
+
+    def call(user, priority, tokens):
+        ticket = scheduler.acquire(user, priority, tokens)
+        with lock:
+            order.append((user, priority))
+        scheduler.release(ticket)
+
+    threads = [threading.Thread(target=call, args=args) for args in calls]
+    for thread in threads:
+        thread.start()
+    return order, threads
+
+
+def test_interactive_goes_before_bulk():
+    scheduler = FairScheduler(max_concurrent=1)
+    blocker = scheduler.acquire("carol")
+    order, threads = run_calls(scheduler, [("alice", BULK, 10)] * 3 + [("bob", INTERACTIVE, 10)] * 2)
+    wait_until(lambda: queued(scheduler) == 5)
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join(2)
+    assert [priority for _, priority in order] == [INTERACTIVE, INTERACTIVE, BULK, BULK, BULK]
+
+
+def test_weights_share_calls_between_users():
+    scheduler = FairScheduler(max_concurrent=1)
+    scheduler.set_weight("alice", 2)
+    blocker = scheduler.acquire("carol")
+    order, threads = run_calls(scheduler, [("alice", INTERACTIVE, 100)] * 12 + [("bob", INTERACTIVE, 100)] * 12)
+    wait_until(lambda: queued(scheduler) == 24)
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join(2)
+    first = [user for user, _ in order[:12]]
+    # Twice the weight, twice the calls while both have work queued
+    assert 7 <= first.count("alice") <= 9
+
+
+def test_per_user_concurrency_cap():
+    scheduler = FairScheduler(max_concurrent=10, user_max_concurrent=2)
+    held = [scheduler.acquire("alice"), scheduler.acquire("alice")]
+    order, threads = run_calls(scheduler, [("alice", INTERACTIVE, 1)])
+    wait_until(lambda: queued(scheduler) == 1)
+    # Another user isn't held up by alice's cap
+    scheduler.release(scheduler.acquire("bob"))
+    assert order == []
+    scheduler.release(held.pop())
+    threads[0].join(2)
+    assert order == [("alice", INTERACTIVE)]
+
+
+def test_token_quota_makes_the_next_call_wait():
+    scheduler = FairScheduler(user_tokens_per_minute=600)   # refills 10 tokens a second
+    scheduler.release(scheduler.acquire("alice", tokens=600))
+    start = time.monotonic()
+    scheduler.release(scheduler.acquire("alice", tokens=5))
+    assert 0.3 < time.monotonic() - start < 2.0
+    # Other users have their own quota
+    start = time.monotonic()
+    scheduler.release(scheduler.acquire("bob", tokens=600))
+    assert time.monotonic() - start < 0.2
+
+
+def test_weights_must_be_positive():
+    scheduler = FairScheduler()
+    with pytest.raises(ValueError):
+        scheduler.set_weight("alice", 0)
+    assert parse_user_weights("alice=2, bob=0,carol=x,=3, dave=0.5") == (
+        {"alice": 2.0, "dave": 0.5}, ["bob=0", "carol=x", "=3"]
+    )
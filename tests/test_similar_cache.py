@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from cache import DiskCache
+from llm import SimilarQuestionCache
+
+
+@pytest.fixture
+def disk(tmp_path):
+    return DiskCache(str(tmp_path / "similar.sqlite"))
+
+
+def ask(cache, stored, asked):
+    cache.put("doc", stored, "English", "model", f"answer to: {stored}", 1.0)
+    match = cache.get("doc", asked, "English", "model")
+    return match[0] if match else None
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("What was revenue in 2024?", "2024 revenue?"),
+    ("What are the main risk factors?", "Please tell me the main risk factors"),
+    ("What were the company's revenues by segment?", "revenue by segment"),
+])
+def test_rephrased_questions_hit(disk, stored, asked):
+    assert ask(SimilarQuestionCache(disk), stored, asked) == f"answer to: {stored}"
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("What are the risk factors for revenue in the European segment?",
+     "What are the risk factors for revenue in the Asian segment?"),
+    ("What drove the margin expansion this year?", "What drove the margin contraction this year?"),
+    ("What are the capital expenditure plans?", "What are the dividend plans?"),
+    ("What was revenue in 2023?", "What was revenue in 2024?"),
+    ("Why did revenue fall in 2024?", "When did revenue fall in 2024?"),
+    ("Did margins improve in 2024?", "Why did margins improve in 2024?"),
+    ("Who is the CEO?", "Who was the CEO?"),
+    ("Why did the board raise the dividend?", "Why didn't the board raise the dividend?"),
+])
+def test_questions_about_something_else_miss(disk, stored, asked):
+    assert ask(SimilarQuestionCache(disk), stored, asked) is None
+
+
+def test_threshold_decides_close_rephrasings(disk):
+    stored = "What were the main drivers of revenue growth in the retail segment?"
+    asked = "What were the drivers of revenue growth in the retail segment?"
+    assert ask(SimilarQuestionCache(disk, threshold=0.85), stored, asked) == f"answer to: {stored}"
+    assert ask(SimilarQuestionCache(disk, threshold=0.95), stored, asked) is None
+
+
+def test_expired_questions_are_not_served(disk):
+    cache = SimilarQuestionCache(disk, ttl=60)
+    cache.put("doc", "What was revenue in 2024?", "English", "model", "old answer", 1.0)
+    cache._set(cache.key("doc", "English", "model")).entries[0]["created_at"] = time.time() - 120
+    assert cache.get("doc", "2024 revenue?", "English", "model") is None
+
+
+def test_writers_in_other_processes_are_merged(disk):
+    first, second = SimilarQuestionCache(disk), SimilarQuestionCache(disk)
+    first.get("doc", "warm up", "English", "model")
+    second.get("doc", "warm up", "English", "model")
+    first.put("doc", "What was revenue in 2024?", "English", "model", "revenue", 1.0)
+    second.put("doc", "What was net income in 2024?", "English", "model", "net income", 1.0)
+    stored = disk.get(SimilarQuestionCache.key("doc", "English", "model"))
+    assert [entry["answer"] for entry in stored] == ["revenue", "net income"]
@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from jobs import Job, JobCancelled
+from llm import FakeModel, SingleFlight, single_flight_key
+
+QUESTION = "What was FY24 revenue?"
+
+
+def streaming_call(model, calls, on_chunk=None):
+    def lead(flight):
+        calls.append(threading.current_thread().name)
+        text = ""
+        for chunk in model.generate_content(f"Question: {QUESTION}", stream=True):
+            text += chunk.text
+            flight.partial = text
+            if on_chunk is not None:
+                on_chunk(text)
+        flight.meta = {"latency": 1.0}
+        return text
+    return lead
+
+
+def test_concurrent_identical_requests_share_one_slow_call():
+    flights = SingleFlight()
+    model = FakeModel(chunk_delay=0.05)
+    calls = []
+    key = single_flight_key("doc", QUESTION, "English", "fake-model")
+    updates = []
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(
+            lambda _: flights.do(key, streaming_call(model, calls), on_update=updates.append), range(10)
+        ))
+
+    assert len(calls) == 1
+    assert len({answer for answer, _, _ in results}) == 1
+    assert sum(shared for _, _, shared in results) == 9
+    assert updates, "waiters should follow the streamed text"
+    stats = flights.stats()
+    assert stats["calls"] == 1 and stats["coalesced"] == 9 and stats["in_flight"] == 0
+
+
+def test_different_questions_are_not_coalesced():
+    flights = SingleFlight()
+    model = FakeModel(chunk_delay=0.01)
+    calls = []
+    keys = [single_flight_key("doc", q, "English", "fake-model") for q in ("FY24 revenue?", "FY23 revenue?")]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(lambda key: flights.do(key, streaming_call(model, calls)), keys))
+    assert len(calls) == 2
+
+
+def test_cancelled_leader_does_not_fail_its_waiters():
+    flights = SingleFlight()
+    model = FakeModel(chunk_delay=0.05)
+    calls = []
+    key = single_flight_key("doc", QUESTION, "English", "fake-model")
+    leader_job = Job("job-1")
+    leader_started = threading.Event()
+
+    def cancelling_chunk(text):
+        leader_started.set()
+        leader_job.set_partial(text)   # raises JobCancelled once cancel is requested
+
+    def leader():
+        try:
+            flights.do(key, streaming_call(model, calls, cancelling_chunk))
+        except JobCancelled:
+            return "cancelled"
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        leading = pool.submit(leader)
+        leader_started.wait(5)
+        waiters = [pool.submit(flights.do, key, streaming_call(model, calls)) for _ in range(2)]
+        leader_job.cancel_requested = True
+        assert leading.result() == "cancelled"
+        answers = [future.result()[0] for future in waiters]
+
+    assert all(answer.startswith("This is a fake answer") for answer in answers)
+    assert len(calls) == 2   # the cancelled leader, then one waiter took over for both
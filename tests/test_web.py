@@ -0,0 +1,137 @@
+import glob
+import gzip
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import web
+from cache import DiskCache
+from web import fetch_url_text, parse_paragraphs, stream_paragraphs
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "*.html.gz")))
+
+
+class ChunkedResponse:
+    def __init__(self, body):
+        self.body = body
+        self.encoding = "utf-8"
+        self.bytes_read = 0
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            self.bytes_read += chunk_size
+            yield self.body[start:start + chunk_size]
+
+
+@pytest.mark.parametrize("path", FIXTURES, ids=os.path.basename)
+def test_stream_matches_beautifulsoup_on_saved_pages(path):
+    with gzip.open(path, "rb") as f:
+        body = f.read()
+    assert stream_paragraphs(ChunkedResponse(body)) == parse_paragraphs(body.decode("utf-8"))
+
+
+def test_stream_stops_after_enough_paragraphs():
+    body = b"<html><body>" + b"<p>para</p>" * 10_000 + b"</body></html>"
+    response = ChunkedResponse(body)
+    assert stream_paragraphs(response, limit=3) == "para\npara\npara"
+    assert response.bytes_read < len(body)
+
+
+def test_stream_respects_byte_cap():
+    body = b"<p>" + b"x" * 100_000 + b"</p><p>never reached</p>"
+    response = ChunkedResponse(body)
+    text = stream_paragraphs(response, max_bytes=20_000)
+    assert "never reached" not in text
+    assert len(text) <= 20_000
+
+
+# ------------------ HTTP CACHE ------------------
+
+class Site(BaseHTTPRequestHandler):
+    """Serves /etag and /last-modified; both answer a matching conditional request with 304."""
+    version = "1"
+    requests = []
+
+    def do_GET(self):
+        Site.requests.append((self.path, self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")))
+        etag = f'"v{Site.version}"'
+        last_modified = f"Mon, 0{Site.version} Jan 2024 00:00:00 GMT"
+        if self.path == "/etag" and self.headers.get("If-None-Match") == etag:
+            return self._send(304)
+        if self.path == "/last-modified" and self.headers.get("If-Modified-Since") == last_modified:
+            return self._send(304)
+        body = f"<html><body><p>Version {Site.version} of {self.path}</p></body></html>".encode()
+        headers = {"ETag": etag} if self.path == "/etag" else {"Last-Modified": last_modified}
+        self._send(200, body, headers)
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site(monkeypatch, tmp_path):
+    cache = DiskCache(str(tmp_path / "http.sqlite"))
+    monkeypatch.setattr(web, "get_cache", lambda name, max_bytes=None: cache)
+    monkeypatch.setattr(web, "http_stats", dict.fromkeys(web.http_stats, 0))
+    Site.version, Site.requests = "1", []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Site)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("path", ["/etag", "/last-modified"])
+def test_unchanged_page_is_revalidated_with_304(site, path):
+    _, base = site
+    assert fetch_url_text(base + path) == f"Version 1 of {path}"
+    # Inside the TTL the network isn't touched
+    assert fetch_url_text(base + path) == f"Version 1 of {path}"
+    assert len(Site.requests) == 1
+    # Past it, a conditional request comes back 304 and the cached text is used
+    assert fetch_url_text(base + path, ttl=0) == f"Version 1 of {path}"
+    assert len(Site.requests) == 2 and any(Site.requests[1][1:])
+    assert web.http_stats == {"fresh": 1, "revalidated": 1, "fetched": 1, "stale": 0}
+
+
+def test_changed_page_is_downloaded_again(site):
+    _, base = site
+    fetch_url_text(base + "/etag")
+    Site.version = "2"
+    assert fetch_url_text(base + "/etag", ttl=0) == "Version 2 of /etag"
+    assert web.http_stats["fetched"] == 2
+
+
+def test_stale_copy_is_served_when_the_site_is_down(site):
+    server, base = site
+    fetch_url_text(base + "/etag")
+    server.shutdown()
+    server.server_close()
+    assert fetch_url_text(base + "/etag", ttl=0) == "Version 1 of /etag"
+    assert web.http_stats["stale"] == 1
+    with pytest.raises(web.requests.RequestException):
+        fetch_url_text(base + "/never-fetched")
+
+
+def test_offline_serves_the_cache_and_never_the_network(site):
+    _, base = site
+    fetch_url_text(base + "/etag")
+    assert fetch_url_text(base + "/etag", offline=True) == "Version 1 of /etag"
+    assert fetch_url_text(base + "/etag", ttl=0, offline=True) == "Version 1 of /etag"
+    with pytest.raises(LookupError):
+        fetch_url_text(base + "/last-modified", offline=True)
+    assert len(Site.requests) == 1
+    # A fresh entry read offline isn't stale
+    assert web.http_stats == {"fresh": 1, "revalidated": 0, "fetched": 1, "stale": 1}
@@ -0,0 +1,216 @@
+import codecs
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+from cache import get_cache
+
+
+# ------------------ WEB FETCHING ------------------
+# Articles are fetched on a bounded thread pool through one pooled Session,
+# so connections (and TLS handshakes) are reused between requests. A per-host
+# limit stops a list of 50 links from the same site hammering that site.
+
+FETCH_TIMEOUT = 10
+FETCH_MAX_WORKERS = 8
+FETCH_MAX_PER_HOST = 2
+MAX_PARAGRAPHS = 50
+USER_AGENT = "Mozilla/5.0"
+
+# Bodies are streamed into an incremental parser and the download stops as
+# soon as MAX_PARAGRAPHS have been collected, or at FETCH_MAX_BYTES at most.
+# Set STREAM_FETCH = False to go back to the full BeautifulSoup parse.
+STREAM_FETCH = True
+FETCH_MAX_BYTES = 2 * 1024 * 1024
+FETCH_CHUNK_SIZE = 16 * 1024
+
+# Fetched pages are kept on disk with their ETag/Last-Modified. Inside the TTL
+# the cached text is used as is; after that the page is revalidated with a
+# conditional request, so an unchanged page costs a 304 and no parsing.
+HTTP_CACHE_TTL = 15 * 60
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+http_stats = {"fresh": 0, "revalidated": 0, "fetched": 0, "stale": 0}
+_http_stats_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FETCH_MAX_WORKERS, pool_maxsize=FETCH_MAX_WORKERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"User-Agent": USER_AGENT})
+            _session = session
+        return _session
+
+
+def _host_limit(url):
+    host = urlparse(url).netloc.lower()
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(FETCH_MAX_PER_HOST)
+        return _host_limits[host]
+
+
+def parse_paragraphs(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    # Get visible text only
+    paragraphs = [p.get_text() for p in soup.find_all('p')]
+    return "\n".join(paragraphs[:MAX_PARAGRAPHS])  # Limit to 50 paragraphs
+
+
+# Tags whose end implicitly closes an open <p>, the same way a tree builder would
+_BLOCK_END_TAGS = {
+    "div", "section", "article", "main", "header", "footer", "aside", "nav",
+    "blockquote", "li", "td", "th", "table", "form", "body", "html",
+}
+
+
+class ParagraphCollector(HTMLParser):
+    def __init__(self, limit=MAX_PARAGRAPHS):
+        super().__init__()
+        self.limit = limit
+        self.paragraphs = []
+        self._current = None
+
+    @property
+    def done(self):
+        return len(self.paragraphs) >= self.limit
+
+    def _close_paragraph(self):
+        if self._current is not None:
+            self.paragraphs.append("".join(self._current))
+            self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            self._close_paragraph()
+            self._current = []
+
+    def handle_endtag(self, tag):
+        if tag == "p" or tag in _BLOCK_END_TAGS:
+            self._close_paragraph()
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current.append(data)
+
+
+def stream_paragraphs(response, limit=MAX_PARAGRAPHS, max_bytes=FETCH_MAX_BYTES):
+    # Reads the body chunk by chunk and stops early, so a heavy page is never
+    # fully downloaded just to keep its first few paragraphs
+    try:
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = ParagraphCollector(limit)
+    received = 0
+    for chunk in response.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+        received += len(chunk)
+        if received > max_bytes:
+            chunk = chunk[:len(chunk) - (received - max_bytes)]
+        parser.feed(decoder.decode(chunk))
+        if parser.done or received >= max_bytes:
+            break
+    else:
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+    parser._close_paragraph()
+    return "\n".join(parser.paragraphs[:limit])
+
+
+def _count(outcome):
+    with _http_stats_lock:
+        http_stats[outcome] += 1
+
+
+def fetch_url_text(url, ttl=HTTP_CACHE_TTL, offline=False):
+    """
+    Returns the first paragraphs of `url`, going through the HTTP cache.
+    With offline=True the network is never touched and whatever is cached is
+    served, however old. Raises on failure; callers decide how to show it.
+    """
+    cache = get_cache("http", max_bytes=HTTP_CACHE_MAX_BYTES)
+    entry = cache.get(url)
+
+    if entry and (offline or time.time() - entry["fetched_at"] < ttl):
+        # Offline serves anything cached, but only what is past the TTL is stale
+        _count("fresh" if time.time() - entry["fetched_at"] < ttl else "stale")
+        return entry["text"]
+    if offline:
+        raise LookupError(f"{url} is not in the offline cache")
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        # The body is read inside the host limit too, so it covers the download
+        with _host_limit(url), get_session().get(url, headers=headers, timeout=FETCH_TIMEOUT, stream=STREAM_FETCH) as response:
+            if response.status_code == 304 and entry:
+                text = None
+            elif STREAM_FETCH:
+                text = stream_paragraphs(response)
+            else:
+                text = parse_paragraphs(response.text)
+    except requests.RequestException:
+        # Site is down or we are offline: an old copy beats an error
+        if entry:
+            _count("stale")
+            return entry["text"]
+        raise
+
+    if text is None:
+        entry["fetched_at"] = time.time()
+        cache.set(url, entry)
+        _count("revalidated")
+        return entry["text"]
+
+    if response.status_code == 200:
+        cache.set(url, {
+            "text": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        })
+    _count("fetched")
+    return text
+
+
+def fetch_all(urls, max_workers=FETCH_MAX_WORKERS, on_done=None, offline=False):
+    """
+    Fetches every url concurrently. Returns a list of (url, text, error) in
+    the same order as `urls`. on_done(done_count, total, url) is called from
+    the calling thread as each fetch completes, so it is safe to update
+    Streamlit widgets from it.
+    """
+    results = [None] * len(urls)
+    if not urls:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        futures = {pool.submit(fetch_url_text, url, offline=offline): i for i, url in enumerate(urls)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                results[i] = (urls[i], future.result(), None)
+            except Exception as e:
+                results[i] = (urls[i], "", e)
+            if on_done:
+                on_done(done, len(urls), urls[i])
+    return results